@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmarks for every stage of the pipeline on a synthetic corpus. Each stage runs in a fresh process
+# so its peak RSS is its own, and only the stage itself is timed, not the loading of its inputs.
+# Results are appended to a JSON history so runs can be compared across commits.
+
+def load_annotations(corpus_dir):
+    """Read and clean the synthetic annotation spreadsheets the same way process_metadatas does"""
+    import pandas as pd
+    from generate_hathitrust_data.get_annotate_ht_volumes import clean_annotated_df
+    annotation_dir = os.path.join(corpus_dir, 'annotations')
+    annotated_dfs = {}
+    for f in sorted(os.listdir(annotation_dir)):
+        annotated_df = pd.read_csv(os.path.join(annotation_dir, f))
+        annotated_df.Dates = annotated_df.Dates.str.replace('Decmeber', 'December')
+        annotated_df.Dates = annotated_df.Dates.str.replace('Summer', 'July')
+        annotated_dfs[f.split('_annotated')[0]] = annotated_df
+    return annotated_dfs, clean_annotated_df
+
+def load_volumes(corpus_dir):
+    '''Build the inputs of merge_datasets for every volume, like process_volume does after fetching a volume.'''
+    import pandas as pd
+    annotated_dfs, clean_annotated_df = load_annotations(corpus_dir)
+    volumes = []
+    for f in sorted(os.listdir(os.path.join(corpus_dir, 'metadatas'))):
+        magazine_title = f.rsplit('_', 1)[0]
+        annotated_df = clean_annotated_df(annotated_dfs[magazine_title].copy())
+        md = pd.read_csv(os.path.join(corpus_dir, 'metadatas', f))
+        for row in md.to_dict('records'):
+            volume_df = pd.read_csv(os.path.join(corpus_dir, 'volumes', row['htid'] + '.csv'), keep_default_na=False)
+            volume_df['magazine_title'] = magazine_title
+            volume_df['title'] = magazine_title + '_' + '_'.join(str(row['date']).split(' '))
+            volume_df['htid'] = row['htid']
+            volume_df['link'] = row['link']
+            volume_df['original_volumes'] = row['date']
+            volume_df = volume_df.rename(columns={'lowercase': 'token', 'page': 'sequence'})
+            subset_annotated_df = annotated_df.loc[annotated_df.original_volumes == row['date']].rename(columns={'page_number': 'sequence'})
+            volumes.append((magazine_title, volume_df, subset_annotated_df))
+    return volumes
+
+def stage_clean_annotated_df(corpus_dir, work_dir):
+    annotated_dfs, clean_annotated_df = load_annotations(corpus_dir)
+    start = time.perf_counter()
+    for annotated_df in annotated_dfs.values():
+        clean_annotated_df(annotated_df)
+    return time.perf_counter() - start, sum(len(annotated_df) for annotated_df in annotated_dfs.values()), 0
+
+def stage_merge_datasets(corpus_dir, work_dir):
+    from generate_hathitrust_data.get_annotate_ht_volumes import merge_datasets
+    volumes = load_volumes(corpus_dir)
+    start = time.perf_counter()
+    rows = 0
+    for _, volume_df, subset_annotated_df in volumes:
+        rows += len(merge_datasets(subset_annotated_df, volume_df))
+    return time.perf_counter() - start, rows, 0
+
+def stage_write_volumes(corpus_dir, work_dir):
+    '''Write the merged volumes as csvs in the layout of ../ht_ef_datasets, which the later stages read.'''
+    from generate_hathitrust_data.get_annotate_ht_volumes import merge_datasets
+    merged = [(magazine_title, merge_datasets(subset_annotated_df, volume_df)) for magazine_title, volume_df, subset_annotated_df in load_volumes(corpus_dir)]
+    output_directory = os.path.join(work_dir, 'ht_ef_datasets')
+    start = time.perf_counter()
+    rows, bytes_written = 0, 0
+    for magazine_title, merged_df in merged:
+        folder = os.path.join(output_directory, magazine_title + '_HathiTrust')
+        os.makedirs(folder, exist_ok=True)
+        file_name = os.path.join(folder, merged_df.title.iloc[0] + '.csv')
+        merged_df.to_csv(file_name, index=False)
+        rows += len(merged_df)
+        bytes_written += os.path.getsize(file_name)
+    return time.perf_counter() - start, rows, bytes_written
+
+def run_combined_dataset(work_dir, streaming):
+    from compute_magazines.load_datasets import get_full_combined_dataset
+    output_directory = os.path.join(work_dir, 'ht_ef_datasets') + '/'
+    output_path = os.path.join(output_directory, 'full_hathitrust_annotated_magazines_with_htids.csv')
+    for path in [output_path, os.path.splitext(output_path)[0] + '.fingerprint.json']:
+        if os.path.exists(path):
+            os.remove(path)
+    start = time.perf_counter()
+    df = get_full_combined_dataset(output_path, output_directory, streaming=streaming)
+    return time.perf_counter() - start, len(df), os.path.getsize(output_path)
+
+def stage_get_full_combined_dataset(corpus_dir, work_dir):
+    return run_combined_dataset(work_dir, streaming=False)
+
+def stage_get_full_combined_dataset_streaming(corpus_dir, work_dir):
+    return run_combined_dataset(work_dir, streaming=True)
+
+def stage_compare_pub_counts(corpus_dir, work_dir):
+    '''Count a list of terms per issue on page level text, the way the notebooks call compare_pub_counts.'''
+    import pandas as pd
+    from compute_magazines.calculate_coverage import compare_pub_counts
+    output_path = os.path.join(work_dir, 'ht_ef_datasets', 'full_hathitrust_annotated_magazines_with_htids.csv')
+    df = pd.read_csv(output_path, low_memory=False, keep_default_na=False, na_values=[''])
+    df.token = df.token.astype(str)
+    df['datetime'] = pd.to_datetime(df.datetime)
+    page_df = df.groupby(['cleaned_magazine_title', 'datetime', 'sequence'], as_index=False).agg({'token': ' '.join, 'count': 'sum'})
+    page_df = page_df.rename(columns={'cleaned_magazine_title': 'magazine_title', 'sequence': 'page_number', 'token': 'lowercase', 'count': 'original_counts'})
+    token_counts = df.groupby('token')['count'].sum().sort_values(ascending=False)
+    terms = [term for term in token_counts.index[10:200:10] if not term.isdigit()]
+    start = time.perf_counter()
+    compare_pub_counts(page_df, ['magazine_title', 'datetime'], 'original_counts', 'lowercase', terms)
+    return time.perf_counter() - start, len(page_df) * len(terms), 0
+
+STAGES = {
+    'clean_annotated_df': stage_clean_annotated_df,
+    'merge_datasets': stage_merge_datasets,
+    'write_volumes': stage_write_volumes,
+    'get_full_combined_dataset': stage_get_full_combined_dataset,
+    'get_full_combined_dataset_streaming': stage_get_full_combined_dataset_streaming,
+    'compare_pub_counts': stage_compare_pub_counts,
+}
+
+def run_stage(name, corpus_dir, work_dir):
+    """Run a single stage and measure it. This runs in its own process."""
+    seconds, rows, bytes_written = STAGES[name](corpus_dir, work_dir)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {'stage': name, 'seconds': round(seconds, 4), 'rows': rows, 'rows_per_second': round(rows / seconds, 1) if seconds > 0 else None, 'bytes_written': bytes_written, 'peak_rss_mb': round(peak_rss / 1024 ** 2, 1)}
+
+def get_commit():
+    """Get the current commit so results can be compared across commits"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def append_history(history_path, result):
+    """Append a benchmark run to the JSON history"""
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            history = json.load(f)
+    history.append(result)
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=2)
+
+def run_benchmarks(size='small', stages=None, history_path=None, keep=None, **overrides):
+    '''Generate a synthetic corpus of the given size (with any of its parameters overridden), run the stages in order and return the results.'''
+    from synthetic_corpus import SIZES, generate_corpus
+    config = dict(SIZES[size], **{key: value for key, value in overrides.items() if value is not None})
+    stages = stages or list(STAGES)
+    base_dir = keep if keep is not None else tempfile.mkdtemp(prefix='htrc_benchmark_')
+    corpus_dir = os.path.join(base_dir, 'corpus')
+    work_dir = os.path.join(base_dir, 'work')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        generate_corpus(corpus_dir, **config)
+        results = []
+        context = multiprocessing.get_context('spawn')
+        for name in stages:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                stage_result = executor.submit(run_stage, name, corpus_dir, work_dir).result()
+            print(f"{name:40s} {stage_result['seconds']:>10.3f}s {stage_result['rows_per_second'] or 0:>14,.0f} rows/s {stage_result['peak_rss_mb']:>10.1f} MB")
+            results.append(stage_result)
+    finally:
+        if keep is None:
+            shutil.rmtree(base_dir)
+    result = {'commit': get_commit(), 'timestamp': datetime.now().isoformat(timespec='seconds'), 'size': size, 'config': config, 'stages': results}
+    if history_path is not None:
+        append_history(history_path, result)
+    return result
+
+if __name__ ==  "__main__" :
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on a synthetic corpus')
+    parser.add_argument('--size', choices=['small', 'medium', 'large'], default='small', help='preset corpus size')
+    parser.add_argument('--magazines', type=int, help='number of magazines')
+    parser.add_argument('--volumes', type=int, help='volumes per magazine')
+    parser.add_argument('--issues', type=int, help='issues per volume')
+    parser.add_argument('--pages', type=int, help='pages per issue')
+    parser.add_argument('--tokens-per-page', type=int, help='tokens per page')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), help='stages to run, in order (later stages need the output of write_volumes)')
+    parser.add_argument('--history', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.json'), help='JSON file to append results to')
+    parser.add_argument('--keep', default=None, help='keep the corpus and outputs in this directory')
+    args = parser.parse_args()
+    run_benchmarks(args.size, args.stages, args.history, args.keep, magazines=args.magazines, volumes=args.volumes, issues=args.issues, pages=args.pages, tokens_per_page=args.tokens_per_page)
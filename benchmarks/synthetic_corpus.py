@@ -0,0 +1,87 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Synthetic stand-ins for the Extracted Features volumes and the Notion annotation spreadsheets, so the
+# pipeline can be benchmarked offline. Volumes have the shape of vol.tokenlist(section='all').reset_index()
+# and annotations have the columns of the files in ../annotated_datasets.
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December']
+SECTIONS = ['header', 'body', 'footer']
+POS_TAGS = ['NN', 'NNP', 'VB', 'VBD', 'JJ', 'IN', 'DT', 'CD', 'RB', 'PRP']
+SIZES = {
+    'small': {'magazines': 2, 'volumes': 2, 'issues': 4, 'pages': 24, 'tokens_per_page': 150, 'vocabulary_size': 5000},
+    'medium': {'magazines': 4, 'volumes': 4, 'issues': 12, 'pages': 32, 'tokens_per_page': 250, 'vocabulary_size': 20000},
+    'large': {'magazines': 8, 'volumes': 8, 'issues': 24, 'pages': 48, 'tokens_per_page': 400, 'vocabulary_size': 50000},
+}
+
+def generate_vocabulary(vocabulary_size, rng):
+    """Generate random lowercase tokens, plus page numbers so that digit tokens exist like in the real corpus"""
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    lengths = rng.integers(2, 12, size=vocabulary_size)
+    words = [''.join(rng.choice(letters, size=length)) for length in lengths]
+    return np.array(list(dict.fromkeys(words + [str(i) for i in range(1, 500)])), dtype=object)
+
+def generate_volume(vocabulary, n_pages, tokens_per_page, rng):
+    '''Generate a volume token list with one row per (page, section, token, pos). Token frequencies follow a Zipf distribution like real text.'''
+    ranks = np.minimum(rng.zipf(1.3, size=n_pages * tokens_per_page), len(vocabulary)) - 1
+    volume_df = pd.DataFrame({
+        'page': np.repeat(np.arange(1, n_pages + 1), tokens_per_page),
+        'section': rng.choice(SECTIONS, size=len(ranks), p=[0.05, 0.9, 0.05]),
+        'lowercase': vocabulary[ranks],
+        'pos': rng.choice(POS_TAGS, size=len(ranks)),
+    })
+    # Printed page numbers, so page number inference has something to find
+    numbers = pd.DataFrame({'page': np.arange(1, n_pages + 1), 'section': 'footer', 'lowercase': [str(max(page - 2, 1)) for page in range(1, n_pages + 1)], 'pos': 'CD'})
+    volume_df = pd.concat([volume_df, numbers])
+    return volume_df.groupby(['page', 'section', 'lowercase', 'pos']).size().reset_index(name='count')
+
+def issue_date(volume_index, issue_index, issues_per_volume):
+    """Give every issue a date, alternating the "Month Day Year" and "Month-Month Year" forms"""
+    month = issue_index % 12
+    year = 1960 + volume_index + (issue_index // 12)
+    if issue_index % 3 == 2 and month < 11:
+        return f'{MONTHS[month]}-{MONTHS[month + 1]} {year}'
+    return f'{MONTHS[month]} {1 + (issue_index * 7) % 28} {year}'
+
+def generate_annotations(original_volumes, volume_index, n_issues, pages_per_issue, rng, record_id=None):
+    '''Generate the annotation rows for a volume: a cover, table of contents and end of issue page for every issue, and a duplicates range in some issues.'''
+    rows = []
+    for issue in range(n_issues):
+        first_page = issue * pages_per_issue + 1
+        last_page = first_page + pages_per_issue - 1
+        dates = issue_date(volume_index, issue, n_issues)
+        base = {'Dates': dates, 'Original Volumes': original_volumes, 'Issue Number': issue + 1, 'Volumes': volume_index + 1}
+        notes = f'Record {record_id}' if (record_id is not None) and (issue == 0) else ''
+        rows.append(dict(base, **{'Type of page': 'cover_page', 'Page Number': first_page, 'Notes': notes}))
+        rows.append(dict(base, **{'Type of page': 'toc', 'Page Number': first_page + 1, 'Notes': ''}))
+        if rng.random() < 0.25:
+            start = int(rng.integers(first_page + 2, last_page - 1))
+            rows.append(dict(base, **{'Type of page': 'duplicates', 'Page Number': start, 'Notes': f'{start}-{start + 1}'}))
+        rows.append(dict(base, **{'Type of page': 'end_of_issue', 'Page Number': last_page, 'Notes': ''}))
+    return pd.DataFrame(rows)
+
+def generate_corpus(output_directory, magazines=2, volumes=2, issues=4, pages=24, tokens_per_page=150, vocabulary_size=5000, seed=0):
+    '''Write a synthetic corpus to output_directory: volumes/<htid>.csv token lists, annotations/<magazine>_annotated_dataset.csv spreadsheets and a metadata csv per magazine. Returns the metadata of every volume.'''
+    rng = np.random.default_rng(seed)
+    vocabulary = generate_vocabulary(vocabulary_size, rng)
+    for name in ['volumes', 'annotations', 'metadatas']:
+        os.makedirs(os.path.join(output_directory, name), exist_ok=True)
+
+    metadata = []
+    for magazine in range(magazines):
+        magazine_title = f'synthetic_magazine_{magazine}'
+        record_id = str(100000000 + magazine)
+        annotation_dfs = []
+        magazine_metadata = []
+        for volume in range(volumes):
+            htid = f'syn.{magazine:03d}{volume:05d}'
+            original_volumes = f'v.{volume + 1} {1960 + volume}'
+            volume_df = generate_volume(vocabulary, issues * pages, tokens_per_page, rng)
+            volume_df.to_csv(os.path.join(output_directory, 'volumes', htid + '.csv'), index=False)
+            annotation_dfs.append(generate_annotations(original_volumes, volume, issues, pages, rng, record_id if volume == 0 else None))
+            magazine_metadata.append({'link': f'https://hdl.handle.net/2027/{htid}', 'date': original_volumes, 'htid': htid, 'title': magazine_title})
+        pd.concat(annotation_dfs).to_csv(os.path.join(output_directory, 'annotations', f'{magazine_title}_annotated_dataset.csv'), index=False)
+        pd.DataFrame(magazine_metadata)[['link', 'date', 'htid']].to_csv(os.path.join(output_directory, 'metadatas', f'{magazine_title}_{record_id}.csv'), index=False)
+        metadata.extend(magazine_metadata)
+    return pd.DataFrame(metadata)
@@ -0,0 +1,63 @@
+import pandas as pd
+
+# Pre-aggregated page level cube of the combined dataset: one row per (magazine, issue datetime, htid,
+# sequence, type_of_page) with the page's word total and the counts of a set of terms. The charts read
+# from the cube and reduce it further before handing it to Altair, so the Vega spec only embeds the
+# aggregated rows instead of every token.
+
+CUBE_COLUMNS = ['magazine_title', 'datetime', 'htid', 'sequence', 'type_of_page']
+COUNTS_COLUMN = 'original_counts'
+# Number of token rows, so that sizes from the cube match counts of rows of the combined dataset
+ROWS_COLUMN = 'rows'
+TERM_PREFIX = 'term_counts_'
+# Coarser and coarser issue dates to try when downsampling a chart
+DOWNSAMPLE_FREQUENCIES = ['MS', 'QS', 'AS']
+
+def term_column(term):
+    return TERM_PREFIX + term
+
+def cube_terms(cube):
+    """Get the terms that have counts in a cube"""
+    return [column[len(TERM_PREFIX):] for column in cube.columns if column.startswith(TERM_PREFIX)]
+
+def aggregate_chunk(df, terms, token_column='token', counts_column='count', magazine_column='cleaned_magazine_title'):
+    '''Aggregate token rows of the combined dataset to cube rows. Terms are matched as exact tokens.'''
+    df = df.rename(columns={magazine_column: 'magazine_title', counts_column: COUNTS_COLUMN})
+    df['type_of_page'] = df.type_of_page.fillna('content')
+    df[ROWS_COLUMN] = 1
+    tokens = df[token_column].astype(str)
+    for term in terms:
+        df[term_column(term)] = df[COUNTS_COLUMN].where(tokens == term, 0)
+    value_columns = [COUNTS_COLUMN, ROWS_COLUMN] + [term_column(term) for term in terms]
+    return df.groupby(CUBE_COLUMNS, as_index=False, observed=True)[value_columns].sum()
+
+def build_cube(uncombined_df_path, terms=None, chunksize=1000000):
+    '''Build the cube from the combined dataset csv, reading it in chunks so that the token rows never have to fit in memory at once.'''
+    terms = sorted(set(terms or []))
+    usecols = ['cleaned_magazine_title', 'datetime', 'htid', 'sequence', 'type_of_page', 'token', 'count']
+    chunks = []
+    for df in pd.read_csv(uncombined_df_path, usecols=usecols, chunksize=chunksize, low_memory=False):
+        chunks.append(aggregate_chunk(df, terms))
+    cube = pd.concat(chunks)
+    # A page can be split across chunks, so sum the partial rows again
+    value_columns = [COUNTS_COLUMN, ROWS_COLUMN] + [term_column(term) for term in terms]
+    cube = cube.groupby(CUBE_COLUMNS, as_index=False)[value_columns].sum()
+    cube['datetime'] = pd.to_datetime(cube.datetime)
+    return cube
+
+def reduce_cube(cube, group_columns, value_columns=None):
+    """Sum the cube over everything but group_columns. `size` is the number of token rows in each group, like counting the rows of the combined dataset."""
+    value_columns = value_columns or [COUNTS_COLUMN]
+    reduced = cube.groupby(group_columns, observed=True)[value_columns + [ROWS_COLUMN]].sum()
+    return reduced.rename(columns={ROWS_COLUMN: 'size'}).reset_index()
+
+def downsample(df, max_rows, group_columns, value_columns, time_column='datetime'):
+    '''Reduce an aggregated frame to at most max_rows by summing it over monthly, then quarterly, then yearly dates. Returns the frame unchanged if it is already small enough, and the yearly frame if nothing is.'''
+    if (max_rows is None) or (len(df) <= max_rows):
+        return df
+    other_columns = [column for column in group_columns if column != time_column]
+    for frequency in DOWNSAMPLE_FREQUENCIES:
+        downsampled = df.groupby(other_columns + [pd.Grouper(key=time_column, freq=frequency)], observed=True)[value_columns].sum().reset_index()
+        if len(downsampled) <= max_rows:
+            break
+    return downsampled
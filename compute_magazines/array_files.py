@@ -0,0 +1,28 @@
+import os
+import json
+import numpy as np
+from scipy import sparse
+
+SPARSE_ARRAYS = ['data', 'indices', 'indptr']
+
+def save_arrays(path, arrays, metadata, metadata_file='metadata.json'):
+    """Save named numpy arrays as .npy files in a directory, next to a json file of metadata"""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    with open(os.path.join(path, metadata_file), 'w') as f:
+        json.dump(metadata, f)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + '.npy'), array)
+
+def load_arrays(path, names, mmap_mode='r', metadata_file='metadata.json'):
+    """Load the metadata and the named arrays saved by save_arrays, memory mapping the arrays"""
+    with open(os.path.join(path, metadata_file)) as f:
+        metadata = json.load(f)
+    return metadata, {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in names}
+
+def sparse_arrays(matrix):
+    return {name: getattr(matrix, name) for name in SPARSE_ARRAYS}
+
+def csr_from_arrays(arrays, shape):
+    """Wrap saved data, indices and indptr arrays in a CSR matrix without copying them"""
+    return sparse.csr_matrix(tuple(arrays[name] for name in SPARSE_ARRAYS), shape=shape, copy=False)
@@ -1,23 +1,38 @@
 
+import re
 import pandas as pd
 import numpy as np
 import altair as alt
+from .dask_coverage import is_dask_dataframe, coverage_totals, pub_counts, overall_frequency, count_term
+from .aggregate_cube import COUNTS_COLUMN, reduce_cube, downsample, term_column
  
 import warnings
 warnings.filterwarnings('ignore')
 
-def chart_overall_frequency(df):
-    '''Chart overall frequency for all magazines in the corpus. Tooltips show dates, title, and size of magazine. Circles are sized by counts of words in the magazine.'''
+def overall_frequency_data(df=None, cube=None, max_rows=None):
+    """Aggregate the corpus to one row per date and magazine with its size (number of token rows) and number of words, from a cube, a dask dataframe or a pandas dataframe"""
+    group_columns = ['datetime', 'magazine_title']
+    if cube is not None:
+        data = reduce_cube(cube, group_columns, [COUNTS_COLUMN])
+    elif is_dask_dataframe(df):
+        data = overall_frequency(df, group_columns, 'original_counts')
+    else:
+        data = df.groupby(group_columns, observed=True).agg(size=('original_counts', 'size'), original_counts=('original_counts', 'sum')).reset_index()
+    return downsample(data, max_rows, group_columns, ['size', 'original_counts'])
+
+def chart_overall_frequency(df=None, cube=None, max_rows=None):
+    '''Chart overall frequency for all magazines in the corpus. Tooltips show dates, title, and size of magazine. Circles are sized by counts of words in the magazine. The data is aggregated per date and magazine before charting (from the aggregate cube if one is passed) and downsampled to coarser dates if it has more than max_rows rows.'''
     
     selection = alt.selection_single(empty='all', fields=['datetime'])
-    chart = alt.Chart(df[['datetime', 'original_counts', 'magazine_title']]).mark_circle(
+    data = overall_frequency_data(df, cube, max_rows)
+    chart = alt.Chart(data).mark_circle(
         opacity=0.5,
         stroke='black',
         strokeWidth=1
     ).encode(
         x='datetime:T',
         y='magazine_title:O',
-        size=alt.Size('count()', scale=alt.Scale(range=[0, 2000]),),
+        size=alt.Size('size:Q', scale=alt.Scale(range=[0, 2000]),),
         color=alt.Color('magazine_title:O',
                         scale=alt.Scale(scheme='plasma')),
 #         row=alt.Row('magazine_title:O', 
@@ -28,7 +43,7 @@ def chart_overall_frequency(df):
 #                     spacing=10)
         opacity=alt.condition(
             selection, alt.value(1), alt.value(0.2)),
-        tooltip=['datetime', alt.Tooltip('count()', title='Size of magazine'), alt.Tooltip('sum(original_counts)', title='Number of words'), 'magazine_title']
+        tooltip=['datetime', alt.Tooltip('size:Q', title='Size of magazine'), alt.Tooltip('original_counts:Q', title='Number of words'), 'magazine_title']
         
     ).add_selection(
         selection
@@ -38,13 +53,49 @@ def chart_overall_frequency(df):
     )
     return chart
 
-def chart_coverage_frequency(df, group_column, counts_column, text_column, term):
-    """Method for calculating rate of coverage for either one term or a group of terms (grouped). Generates frequency graphs for term/terms, as well as the publication as a whole. Then compares rate of coverage to rate of publishing."""
+def term_variants(term, variants=None):
+    """Get a term followed by its variants (from fuzzy_terms.expand_terms), or just the term"""
+    if variants is None:
+        return [term]
+    return [term] + [variant for variant in variants.get(term, []) if variant != term]
+
+def term_pattern(term, variants=None):
+    '''Get the regex matching a term or any of its variants. The term is used as is, like str.contains always did, and the variants are escaped.'''
+    return '|'.join([term] + [re.escape(variant) for variant in term_variants(term, variants)[1:]])
+
+def expanded_terms(terms, variants=None):
+    """Get all the terms and their variants as one list"""
+    return list(dict.fromkeys(variant for term in terms for variant in term_variants(term, variants)))
+
+def coverage_totals_from_index(index, group_column, counts_column, term):
+    """Get the total words and the words on pages containing any of the terms for each group from a TermIndex"""
+    pages = index.pages().rename(columns={'page_total': counts_column})
+    total_words = pages.groupby([group_column])[counts_column].sum().reset_index()
+    page_ids = np.unique(index.postings(term).page_id.values)
+    total_term_words = pages.iloc[page_ids].groupby([group_column])[counts_column].sum().reset_index()
+    return total_words, total_term_words
+
+def coverage_totals_from_cube(cube, group_column, counts_column, term):
+    """Get the total words and the words on pages containing any of the terms for each group from the aggregate cube"""
+    cube = cube.rename(columns={COUNTS_COLUMN: counts_column})
+    total_words = cube.groupby([group_column])[counts_column].sum().reset_index()
+    matches = (cube[[term_column(t) for t in term]] > 0).any(axis=1)
+    total_term_words = cube[matches].groupby([group_column])[counts_column].sum().reset_index()
+    return total_words, total_term_words
+
+def chart_coverage_frequency(df, group_column, counts_column, text_column, term, index=None, cube=None, variants=None):
+    """Method for calculating rate of coverage for either one term or a group of terms (grouped). Generates frequency graphs for term/terms, as well as the publication as a whole. Then compares rate of coverage to rate of publishing. If a TermIndex is passed the counts come from its postings (exact token matches) instead of scanning df, the same goes for an aggregate cube with counts for the terms, and if df is a dask dataframe the totals are computed over its partitions. Pages with any of the `variants` of the terms (see fuzzy_terms.expand_terms) count as well."""
     
-    total_words = df.groupby([group_column])[counts_column].sum().reset_index()
+    if index is not None:
+        total_words, total_term_words = coverage_totals_from_index(index, group_column, counts_column, expanded_terms(term, variants))
+    elif cube is not None:
+        total_words, total_term_words = coverage_totals_from_cube(cube, group_column, counts_column, expanded_terms(term, variants))
+    elif is_dask_dataframe(df):
+        total_words, total_term_words = coverage_totals(df, group_column, counts_column, text_column, [term_pattern(t, variants) for t in term])
+    else:
+        total_words = df.groupby([group_column])[counts_column].sum().reset_index()
+        total_term_words = df[(df[text_column].str.contains('|'.join([term_pattern(t, variants) for t in term])))& (df[text_column].isna()==False)].groupby([group_column])[counts_column].sum().reset_index()
     total_words['type'] = 'total_counts'
-    
-    total_term_words = df[(df[text_column].str.contains('|'.join(term)))& (df[text_column].isna()==False)].groupby([group_column])[counts_column].sum().reset_index()
     total_term_words['type'] = 'term_counts'
     
     totals = pd.concat([total_words, total_term_words])
@@ -74,33 +125,76 @@ def chart_coverage_frequency(df, group_column, counts_column, text_column, term)
     
     return final_charts
 
-def compare_pub_counts(df, group_columns, counts_column, text_column, terms):
-    '''Get frequency for a set of terms in a group of publications'''
+def compare_pub_counts_from_index(index, group_columns, counts_column, terms, variants=None):
+    '''Get frequency for a set of terms in a group of publications from the postings of a TermIndex. Terms are matched as exact tokens (or n-grams if the index has them), along with their variants. Group columns can be any of magazine_title, datetime, htid and sequence.'''
+    pages = index.pages().rename(columns={'page_total': counts_column})
+    total_sum = pages.groupby(group_columns)[counts_column].sum().reset_index()
+    postings = index.postings(expanded_terms(terms, variants)).rename(columns={'count': 'term_counts', 'page_total': counts_column})
+    if variants is not None:
+        # Count each page once per term, however many of the term's variants it has
+        postings = postings.merge(pd.DataFrame([(term, variant) for term in terms for variant in term_variants(term, variants)], columns=['term', 'variant']), left_on='term', right_on='variant', suffixes=('_variant', ''))
+        postings = postings.groupby(['term', 'page_id'], as_index=False).agg(dict({column: 'first' for column in postings.columns if column not in ['term', 'page_id', 'term_variant', 'variant', 'term_counts']}, term_counts='sum'))
+    postings['page_number'] = postings.sequence
+    totals = postings.groupby(['term'] + group_columns).agg(term_counts=('term_counts', 'sum'), page_number=('page_number', list), page_counts=(counts_column, 'sum')).reset_index()
+    concat_df = total_sum.merge(pd.DataFrame({'term': terms}), how='cross')
+    concat_df = concat_df.merge(totals, on=group_columns + ['term'], how='left')
+    concat_df[['term_counts', 'page_counts']] = concat_df[['term_counts', 'page_counts']].fillna(0)
+    return concat_df[group_columns + [counts_column, 'term_counts', 'page_number', 'page_counts', 'term']]
+
+def summarize_term_pages(total_sum, total_term_words, group_columns, counts_column, term):
+    """Combine the rows containing a term (with their term_counts) into term counts, page numbers and page counts for every group"""
+    total_pages = total_term_words.groupby(group_columns)['page_number'].apply(lambda x: list(x)).reset_index()
+    total_term_counts = total_term_words.groupby(group_columns)['term_counts'].sum().reset_index()
+    total_counts = total_term_words.groupby(group_columns)[counts_column].sum().reset_index(name='page_counts')
+
+    totals = pd.merge(total_pages, total_counts, on=group_columns)
+    totals = pd.merge(total_term_counts, totals, on=group_columns)
+    totals = pd.merge(total_sum, totals, on=group_columns, how='outer')
+    totals[['term_counts', 'page_counts']] = totals[['term_counts', 'page_counts']].fillna(0)
+    totals['term'] = f'{term}'
+    return totals
+
+def compare_pub_counts_from_cube(cube, group_columns, counts_column, terms, variants=None):
+    '''Get frequency for a set of terms in a group of publications from the aggregate cube. Terms are matched as exact tokens, along with their variants (which need counts in the cube), and page numbers are sequences.'''
+    cube = cube.rename(columns={COUNTS_COLUMN: counts_column})
+    total_sum = cube.groupby(group_columns)[counts_column].sum().reset_index()
+    dfs = []
+    for term in terms:
+        term_counts = cube[[term_column(variant) for variant in term_variants(term, variants)]].sum(axis=1)
+        total_term_words = cube[term_counts > 0].assign(term_counts=term_counts[term_counts > 0])
+        total_term_words['page_number'] = total_term_words.sequence
+        dfs.append(summarize_term_pages(total_sum, total_term_words, group_columns, counts_column, term))
+    return pd.concat(dfs)
+
+def compare_pub_counts(df, group_columns, counts_column, text_column, terms, index=None, cube=None, variants=None, series=None):
+    '''Get frequency for a set of terms in a group of publications. If a TermSeries, a TermIndex or an aggregate cube with counts for the terms is passed the counts come from it instead of scanning df. If df is a dask dataframe all the terms are counted in one pass over its partitions and only the matching rows are loaded. With `variants` (see fuzzy_terms.expand_terms) the counts of each term include its OCR variants.'''
+    if series is not None:
+        return series.term_counts(terms, group_columns, counts_column, variants).drop(columns=['term_frequency'])
+    if index is not None:
+        return compare_pub_counts_from_index(index, group_columns, counts_column, terms, variants)
+    if cube is not None:
+        return compare_pub_counts_from_cube(cube, group_columns, counts_column, terms, variants)
     
+    if is_dask_dataframe(df):
+        patterns = {term: term_pattern(term, variants) for term in terms}
+        total_sum, term_words = pub_counts(df, group_columns, counts_column, text_column, terms, patterns, {term: term_variants(term, variants) for term in terms})
+        return pd.concat([summarize_term_pages(total_sum, term_words[term], group_columns, counts_column, term) for term in terms])
+
     total_sum = df.groupby(group_columns)[counts_column].sum().reset_index()
     dfs = []
     for term in terms:
-        total_term_words = df[(df[text_column].str.contains(term)== True)]
-        total_term_words['term_counts']= total_term_words[text_column].apply(lambda x: x.count(term))
-        total_pages = total_term_words.groupby(group_columns)['page_number'].apply(lambda x: list(x)).reset_index()
-        total_term_counts = total_term_words.groupby(group_columns)['term_counts'].sum().reset_index()
-        total_counts = total_term_words.groupby(group_columns)[counts_column].sum().reset_index(name='page_counts')
-
-        totals = pd.merge(total_pages, total_counts, on=group_columns)
-        totals = pd.merge(total_term_counts, totals, on=group_columns)
-        totals = pd.merge(total_sum, totals, on=group_columns, how='outer')
-        totals[['term_counts', 'page_counts']] = totals[['term_counts', 'page_counts']].fillna(0)
-        totals['term'] = f'{term}'
-        dfs.append(totals)
+        total_term_words = df[(df[text_column].str.contains(term_pattern(term, variants))== True)]
+        total_term_words['term_counts']= count_term(total_term_words[text_column], term_variants(term, variants))
+        dfs.append(summarize_term_pages(total_sum, total_term_words, group_columns, counts_column, term))
     concat_df = pd.concat(dfs)
     return concat_df
     
-def create_line_graph_term_frequencies(term_counts):
-    '''Create line graphs of term frequencies by publication. Terms are rows, titles are colors.'''
+def create_line_graph_term_frequencies(term_counts, value_column='term_counts'):
+    '''Create line graphs of term frequencies by publication. Terms are rows, titles are colors. Pass value_column='term_frequency' to plot the counts normalized by issue totals from TermSeries.term_counts.'''
     selection = alt.selection_multi(fields=['title'], bind='legend')
     chart = alt.Chart(term_counts).mark_bar(size=2).encode(
         x=alt.X('datetime:T', axis=alt.Axis(title='')),
-        y=alt.Y('term_counts:Q', axis=alt.Axis(title='')),
+        y=alt.Y(value_column + ':Q', axis=alt.Axis(title='')),
         color=alt.Color('magazine_title:N', scale=alt.Scale(scheme='plasma')),
         row=alt.Row('term:N', 
             title=None,
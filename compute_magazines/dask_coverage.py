@@ -0,0 +1,75 @@
+import re
+import glob
+import numpy as np
+import pandas as pd
+import dask
+import dask.dataframe as dd
+
+# Out of core backend for the coverage computations in calculate_coverage. The corpus is read lazily as
+# a partitioned dask dataframe, the groupby/sum/term counts run in parallel over the partitions, and
+# only the small aggregated frames are computed into pandas for charting.
+
+def is_dask_dataframe(df):
+    return isinstance(df, dd.DataFrame)
+
+# Text and annotation columns of the volume csvs (and their renamed versions in the combined dataset). A volume
+# whose notes are all empty would otherwise be read as float64 and clash with volumes that have notes.
+TEXT_COLUMNS = ['token', 'pos', 'section', 'type_of_page', 'notes', 'dates', 'magazine_title', 'title', 'htid', 'link', 'original_volumes', 'volumes', 'start_issue', 'end_issue',
+    'cleaned_magazine_title', 'ht_generated_title', 'hdl_link', 'cleaned_volume', 'volume_number']
+
+def read_csv_corpus(path, columns=None, blocksize='64MB', **kwargs):
+    '''Lazily read csvs (a file or glob) with the text columns as strings. Volumes can have different annotation columns, so every file is aligned to the union of their columns (or to `columns`), with missing columns left empty.'''
+    paths = sorted(glob.glob(path))
+    headers = {csv_path: pd.read_csv(csv_path, nrows=0).columns.tolist() for csv_path in paths}
+    if columns is None:
+        columns = list(dict.fromkeys(col for csv_path in paths for col in headers[csv_path]))
+    ddfs = []
+    for csv_path in paths:
+        usecols = [col for col in columns if col in headers[csv_path]]
+        ddf = dd.read_csv(csv_path, usecols=usecols, dtype={col: 'object' for col in usecols if col in TEXT_COLUMNS}, blocksize=blocksize, assume_missing=True, low_memory=False, **kwargs)
+        missing = {col: (None if col in TEXT_COLUMNS else np.nan) for col in columns if col not in usecols}
+        ddfs.append(ddf.assign(**missing)[columns] if missing else ddf[columns])
+    return dd.concat(ddfs) if len(ddfs) > 1 else ddfs[0]
+
+def read_corpus(path, columns=None, blocksize='64MB', **kwargs):
+    '''Lazily read the corpus as a dask dataframe, either from the partitioned Parquet store (a directory) or from csvs (a file or glob such as ../ht_ef_datasets/*/*.csv, see read_csv_corpus). Only the given columns are read.'''
+    if path.endswith('.csv') or ('*' in path):
+        return read_csv_corpus(path, columns=columns, blocksize=blocksize, **kwargs)
+    return dd.read_parquet(path, columns=columns, **kwargs)
+
+def coverage_totals(ddf, group_column, counts_column, text_column, term, scheduler=None):
+    """Get the total words and the words on pages containing any of the terms for each group, in a single pass over the corpus"""
+    total_words = ddf.groupby(group_column)[counts_column].sum()
+    matches = ddf[ddf[text_column].notnull()]
+    matches = matches[matches[text_column].str.contains('|'.join(term))]
+    total_term_words = matches.groupby(group_column)[counts_column].sum()
+    total_words, total_term_words = dask.compute(total_words, total_term_words, scheduler=scheduler)
+    return total_words.reset_index(), total_term_words.reset_index()
+
+def count_pattern(terms):
+    """Get the regex matching any of the terms literally, longest first so that a variant containing another one is matched once"""
+    return '|'.join(re.escape(term) for term in sorted(dict.fromkeys(terms), key=len, reverse=True))
+
+def count_term(text, terms):
+    '''Count the literal occurrences of a term (or any of its variants) in a column of text. Matches do not overlap, so every occurrence is counted once even if it matches several variants.'''
+    return text.str.count(count_pattern(terms)).fillna(0).astype('int64')
+
+def term_pages(ddf, group_columns, counts_column, text_column, term, pattern=None, variants=None):
+    """Lazily select the rows containing a term (matching pattern if given) with their term counts, summed over the variants if given"""
+    matches = ddf[ddf[text_column].str.contains(pattern or term) == True]
+    matches = matches[group_columns + ['page_number', counts_column, text_column]]
+    matches = matches.assign(term_counts=matches[text_column].map_partitions(count_term, variants or [term], meta=('term_counts', 'int64')))
+    return matches.drop(columns=[text_column])
+
+def pub_counts(ddf, group_columns, counts_column, text_column, terms, patterns=None, variants=None, scheduler=None):
+    '''Get the group totals and the matching rows of every term in one computation. All terms share the same read of each partition, and only the matching rows are brought into memory. `patterns` and `variants` map terms to the regex they are matched with and the strings that are counted.'''
+    patterns, variants = patterns or {}, variants or {}
+    total_sum = ddf.groupby(group_columns)[counts_column].sum()
+    results = dask.compute(total_sum, *[term_pages(ddf, group_columns, counts_column, text_column, term, patterns.get(term), variants.get(term)) for term in terms], scheduler=scheduler)
+    return results[0].reset_index(), dict(zip(terms, results[1:]))
+
+def overall_frequency(ddf, group_columns, counts_column, scheduler=None):
+    """Get the number of rows and the sum of counts for each group"""
+    totals = ddf.groupby(group_columns)[counts_column].agg(['count', 'sum'])
+    totals = dask.compute(totals, scheduler=scheduler)[0].reset_index()
+    return totals.rename(columns={'count': 'size', 'sum': counts_column})
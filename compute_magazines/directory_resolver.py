@@ -0,0 +1,83 @@
+import os
+import pandas as pd
+from thefuzz import fuzz
+from .fingerprints import combine_fingerprints, file_fingerprint, code_fingerprint, is_up_to_date, record_fingerprint
+
+# Resolution of each metadata csv to the directory of Extracted Features datasets for its magazine.
+# Directory and metadata file names are normalized once into an index, every metadata file gets its
+# single best matching directory (an exact normalized match, otherwise the best fuzzy match) and the
+# mapping is saved so that get_annotate_ht_volumes and load_datasets share the same resolution.
+
+EF_DIRECTORY = '../ht_ef_datasets/'
+METADATA_DIRECTORY = '../metadatas'
+ANNOTATION_MAPPING_PATH = '../generate_hathitrust_data/annotation_metadata_mapping.csv'
+DIRECTORY_MAPPING_PATH = '../generate_hathitrust_data/directory_annotation_metadata_mapping.csv'
+MAPPING_COLUMNS = ['annotation_file', 'metadata_file', 'magazine_name', 'local_dir', 'file_name', 'fuzzy_ratio', 'final_dir']
+FUZZY_THRESHOLD = 70
+CODE_VERSION = code_fingerprint(os.path.abspath(__file__))
+
+def normalize_name(name):
+    """Normalize a metadata file or directory name: drop numeric parts (record ids and years), lowercase, and drop the _HathiTrust suffix"""
+    names = [part.lower() for part in name.split('_') if part.isdigit() == False]
+    return '_'.join(names).split('_hathitrust')[0]
+
+def metadata_name(metadata_file):
+    return normalize_name(os.path.basename(metadata_file).split('.')[0])
+
+def get_metadata_files(metadata_directory=METADATA_DIRECTORY):
+    """Get the paths of all the metadata csvs, sorted so runs are deterministic"""
+    return sorted(subdir + '/' + f for subdir, dirs, files in os.walk(metadata_directory) for f in files if '.csv' in f)
+
+def build_directory_index(ef_directory=EF_DIRECTORY):
+    '''Index the magazine directories of ef_directory by normalized name. Several directories with the same normalized name are kept in sorted order so the choice between them is deterministic.'''
+    index = {}
+    if not os.path.exists(ef_directory):
+        return index
+    for entry in sorted(os.scandir(ef_directory), key=lambda entry: entry.name):
+        if entry.is_dir():
+            index.setdefault(normalize_name(entry.name), []).append(os.path.join(ef_directory.rstrip('/'), entry.name))
+    return index
+
+def resolve_directory(name, index, threshold=FUZZY_THRESHOLD):
+    '''Get the best directory for a normalized name and its fuzzy ratio: an exact match scores 100, otherwise the highest fuzz.ratio above threshold (ties go to the first name in sorted order). Returns (None, None) if nothing matches.'''
+    if name in index:
+        return index[name][0], 100
+    best_name, best_ratio = None, threshold
+    for dir_name in sorted(index):
+        fuzziness = fuzz.ratio(name, dir_name)
+        if fuzziness > best_ratio:
+            best_name, best_ratio = dir_name, fuzziness
+    if best_name is None:
+        return None, None
+    return index[best_name][0], best_ratio
+
+def resolve_metadata_files(metadata_files, annotation_mapping, ef_directory=EF_DIRECTORY, threshold=FUZZY_THRESHOLD):
+    '''Resolve every metadata file to a single directory. Metadata files without a matching directory (a new magazine) get a new <name>_HathiTrust directory, with no fuzzy ratio.'''
+    index = build_directory_index(ef_directory)
+    rows = []
+    for metadata_file in metadata_files:
+        name = metadata_name(metadata_file)
+        final_dir, fuzzy_ratio = resolve_directory(name, index, threshold)
+        if final_dir is None:
+            final_dir = os.path.join(ef_directory.rstrip('/'), name + '_HathiTrust')
+        rows.append({'metadata_file': metadata_file, 'local_dir': os.path.basename(final_dir), 'file_name': name, 'fuzzy_ratio': fuzzy_ratio, 'final_dir': final_dir})
+    # The annotation mapping has a row per catalog record, so a metadata file built from several records is listed more than once
+    annotation_mapping = annotation_mapping.drop_duplicates(subset='metadata_file')
+    mapping = annotation_mapping.merge(pd.DataFrame(rows, columns=['metadata_file', 'local_dir', 'file_name', 'fuzzy_ratio', 'final_dir']), on='metadata_file', how='right', validate='one_to_one')
+    return mapping[MAPPING_COLUMNS]
+
+def get_mapping_fingerprint(metadata_files, annotation_mapping_path, ef_directory):
+    """Fingerprint the resolution inputs: the metadata file names, the annotation mapping and the directory names"""
+    directories = sorted(os.listdir(ef_directory)) if os.path.exists(ef_directory) else []
+    return combine_fingerprints(CODE_VERSION, *metadata_files, file_fingerprint(annotation_mapping_path), *directories)
+
+def get_directory_mapping(output_path=DIRECTORY_MAPPING_PATH, metadata_directory=METADATA_DIRECTORY, ef_directory=EF_DIRECTORY, annotation_mapping_path=ANNOTATION_MAPPING_PATH, threshold=FUZZY_THRESHOLD):
+    '''Load the metadata file to directory mapping, resolving it again only if a metadata file, the annotation mapping or the set of directories changed.'''
+    metadata_files = get_metadata_files(metadata_directory)
+    fingerprint = get_mapping_fingerprint(metadata_files, annotation_mapping_path, ef_directory)
+    if is_up_to_date(output_path, fingerprint):
+        return pd.read_csv(output_path)
+    mapping = resolve_metadata_files(metadata_files, pd.read_csv(annotation_mapping_path), ef_directory, threshold)
+    mapping.to_csv(output_path, index=False)
+    record_fingerprint(output_path, fingerprint)
+    return mapping
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .array_files import SPARSE_ARRAYS, save_arrays, load_arrays, sparse_arrays, csr_from_arrays
+
+ISSUE_COLUMNS = ['cleaned_magazine_title', 'ht_generated_title', 'volume_number', 'htid', 'hdl_link', 'cleaned_volume', 'start_issue', 'end_issue', 'datetime', 'dates', 'issue_number', 'type_of_page', 'sequence']
+
+class DocumentStore:
+    """Page by term count matrix with its vocabulary and page metadata: row i of `counts` is the page in row i of `pages` and column j is `vocabulary[j]`"""
+
+    def __init__(self, vocabulary, pages, counts):
+        self.vocabulary = np.asarray(vocabulary, dtype=object)
+        self.pages = pages
+        self.counts = counts
+
+    def save(self, path):
+        """Save the store to a directory"""
+        save_arrays(path, sparse_arrays(self.counts), list(self.vocabulary), metadata_file='vocabulary.json')
+        self.pages.to_parquet(os.path.join(path, 'pages.parquet'), index=False)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a store from a directory, memory mapping the count matrix"""
+        vocabulary, arrays = load_arrays(path, SPARSE_ARRAYS, mmap_mode, metadata_file='vocabulary.json')
+        pages = pd.read_parquet(os.path.join(path, 'pages.parquet'))
+        return cls(vocabulary, pages, csr_from_arrays(arrays, (len(pages), len(vocabulary))))
+
+    def page_tokens(self, row):
+        """Get the tokens and counts of a single page"""
+        start, end = self.counts.indptr[row], self.counts.indptr[row + 1]
+        return self.vocabulary[np.asarray(self.counts.indices[start:end])], np.asarray(self.counts.data[start:end])
+
+    def page_text(self, row, repeat_counts=False):
+        '''Rebuild the text of a page by joining its tokens. Tokens are in vocabulary order, and repeated by their count if `repeat_counts`.'''
+        tokens, counts = self.page_tokens(row)
+        if repeat_counts:
+            tokens = np.repeat(tokens, counts)
+        return ' '.join(tokens)
+
+    def texts(self, rows=None, repeat_counts=False):
+        """Lazily rebuild the text of the given pages (all pages by default)"""
+        rows = range(len(self.pages)) if rows is None else rows
+        for row in rows:
+            yield self.page_text(row, repeat_counts=repeat_counts)
+
+    def to_issue_df(self, with_text=False):
+        """Get the page metadata, optionally with a token column of joined text like get_combined_issues"""
+        issue_df = self.pages.copy()
+        if with_text:
+            issue_df['token'] = list(self.texts())
+        return issue_df
+
+def build_document_store(df, page_columns=ISSUE_COLUMNS, token_column='token', count_column='count', vocabulary=None):
+    '''Build a DocumentStore from the token level combined dataset. Tokens are summed per page. If a `vocabulary` is passed it is used as the columns of the matrix (so several stores can share one) and tokens outside it are dropped, otherwise the sorted vocabulary of df is used.'''
+    grouped_pages = df.groupby(page_columns, sort=True, dropna=False, observed=True)
+    page_ids = grouped_pages.ngroup().values
+    pages = grouped_pages.size().reset_index()[page_columns]
+
+    tokens = df[token_column].astype(str)
+    if vocabulary is None:
+        token_ids, vocabulary = pd.factorize(tokens, sort=True)
+    else:
+        token_ids = pd.Index(vocabulary).get_indexer(tokens)
+    known = token_ids >= 0
+    counts = df[count_column].fillna(0).values.astype(np.int32)
+    counts = sparse.coo_matrix((counts[known], (page_ids[known], token_ids[known])), shape=(len(pages), len(vocabulary))).tocsr()
+    counts.sum_duplicates()
+    index_dtype = np.int32 if counts.nnz < np.iinfo(np.int32).max else np.int64
+    counts.indices = counts.indices.astype(index_dtype)
+    counts.indptr = counts.indptr.astype(index_dtype)
+    return DocumentStore(list(vocabulary), pages, counts)
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from itertools import combinations
+
+# Near duplicate page detection for finding repeated scan ranges, which are annotated by hand today as
+# `duplicates` rows with a "start-end" range in their notes. Every page of a DocumentStore gets a
+# MinHash signature of its set of tokens, locality sensitive hashing on bands of the signatures finds
+# candidate pairs without comparing every pair of pages, and runs of matching consecutive pages are
+# turned into suggested duplicate ranges in the same notes format.
+
+MERSENNE_PRIME = (1 << 31) - 1
+DEFAULT_COLUMN_NAMES = {'magazine_title': 'cleaned_magazine_title', 'htid': 'htid', 'original_volumes': 'cleaned_volume', 'sequence': 'sequence'}
+
+def minhash_signatures(counts, num_perm=64, seed=0, batch_size=1000):
+    '''Get the MinHash signature of the token set of every row of a sparse page by term matrix. Rows are hashed in batches so only a batch of hashed tokens is in memory at a time. Empty pages get the maximum value in every position.'''
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    signatures = np.full((counts.shape[0], num_perm), MERSENNE_PRIME, dtype=np.uint64)
+    for start in range(0, counts.shape[0], batch_size):
+        batch = counts[start:start + batch_size]
+        indptr = np.asarray(batch.indptr)
+        lengths = np.diff(indptr)
+        rows = np.flatnonzero(lengths > 0)
+        if len(rows) == 0:
+            continue
+        hashes = (np.asarray(batch.indices, dtype=np.uint64)[:, None] * a + b) % np.uint64(MERSENNE_PRIME)
+        signatures[start + rows] = np.minimum.reduceat(hashes, indptr[rows], axis=0)
+    return signatures
+
+def band_hashes(signatures, bands, seed=0):
+    """Hash each band of rows of the signatures to a single value per page"""
+    rows_per_band = signatures.shape[1] // bands
+    multipliers = np.random.default_rng(seed + 1).integers(1, 1 << 62, size=rows_per_band, dtype=np.uint64) | np.uint64(1)
+    with np.errstate(over='ignore'):
+        return [(signatures[:, band * rows_per_band:(band + 1) * rows_per_band] * multipliers).sum(axis=1) for band in range(bands)]
+
+def candidate_pairs(signatures, bands=16, max_bucket_size=50, rows=None):
+    '''Find the pairs of pages that share a bucket in at least one band. Buckets with more than max_bucket_size pages (blank or boilerplate pages) are skipped so they do not produce a quadratic number of pairs. Returns an array of (i, j) pairs with i < j.'''
+    rows = np.arange(len(signatures)) if rows is None else rows
+    pairs = []
+    for bucket_hashes in band_hashes(signatures[rows], bands):
+        order = np.argsort(bucket_hashes, kind='stable')
+        sorted_hashes = bucket_hashes[order]
+        boundaries = np.flatnonzero(sorted_hashes[1:] != sorted_hashes[:-1]) + 1
+        for bucket in np.split(order, boundaries):
+            if 1 < len(bucket) <= max_bucket_size:
+                pairs.extend(combinations(np.sort(rows[bucket]), 2))
+    if len(pairs) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    return np.unique(np.array(pairs, dtype=np.int64), axis=0)
+
+def similar_pairs(signatures, threshold=0.8, bands=16, max_bucket_size=50, min_tokens=20, counts=None):
+    '''Find the pairs of pages whose estimated Jaccard similarity (the share of equal signature values) is at least threshold. Pages with fewer than min_tokens distinct tokens are ignored when counts are passed.'''
+    rows = None
+    if counts is not None:
+        rows = np.flatnonzero(np.diff(np.asarray(counts.indptr)) >= min_tokens)
+    pairs = candidate_pairs(signatures, bands, max_bucket_size, rows)
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1) if len(pairs) else np.zeros(0)
+    keep = similarity >= threshold
+    return pairs[keep], similarity[keep]
+
+def duplicate_runs(pages, pairs, similarity, min_pages=2, max_gap=1, column_names=None):
+    '''Group matching pages into runs: pages of one volume matching consecutive pages of the same (or another) volume at a constant offset. Within a volume the later page of a pair is the duplicate, across volumes the page of the volume with the greater htid is, and runs shorter than min_pages are dropped. Returns one row per run with its range in the duplicate volume and the range it repeats.'''
+    column_names = dict(DEFAULT_COLUMN_NAMES, **(column_names or {}))
+    pages = pages.reset_index(drop=True)
+    htids = pages[column_names['htid']].astype(str).values
+    sequences = pages[column_names['sequence']].fillna(0).astype(int).values
+    # Order every pair so the original comes first and the duplicate second
+    first, second = pairs[:, 0], pairs[:, 1]
+    swap = (htids[first] > htids[second]) | ((htids[first] == htids[second]) & (sequences[first] > sequences[second]))
+    original = np.where(swap, second, first)
+    duplicate = np.where(swap, first, second)
+    matches = pd.DataFrame({
+        'original_htid': htids[original], 'original_sequence': sequences[original],
+        'htid': htids[duplicate], 'sequence': sequences[duplicate], 'row': duplicate, 'similarity': similarity,
+    })
+    matches = matches[(matches.original_htid != matches.htid) | (matches.original_sequence != matches.sequence)]
+    matches['offset'] = matches.sequence - matches.original_sequence
+    matches = matches.sort_values(by=['htid', 'original_htid', 'offset', 'sequence']).drop_duplicates(subset=['htid', 'original_htid', 'offset', 'sequence'])
+    # A new run starts whenever the volumes or the offset change or the duplicate pages stop being consecutive
+    new_run = (matches.htid != matches.htid.shift()) | (matches.original_htid != matches.original_htid.shift()) | (matches.offset != matches.offset.shift()) | (matches.sequence - matches.sequence.shift() > max_gap)
+    matches['run'] = new_run.cumsum()
+    runs = matches.groupby('run').agg(
+        htid=('htid', 'first'), start=('sequence', 'min'), end=('sequence', 'max'), row=('row', 'first'),
+        duplicate_of_htid=('original_htid', 'first'), duplicate_of_start=('original_sequence', 'min'), duplicate_of_end=('original_sequence', 'max'),
+        pages=('sequence', 'size'), similarity=('similarity', 'mean'),
+    )
+    return runs[runs.pages >= min_pages].reset_index(drop=True)
+
+def suggest_duplicate_ranges(store, threshold=0.8, num_perm=64, bands=16, min_pages=2, max_gap=1, min_tokens=20, max_bucket_size=50, column_names=None):
+    '''Suggest duplicate page ranges for every volume of a DocumentStore, within and across volumes. Each suggestion is an annotation row like the hand made ones: type_of_page "duplicates", page_number at the start of the range and notes "start-end", along with the range it repeats and its mean estimated similarity.'''
+    column_names = dict(DEFAULT_COLUMN_NAMES, **(column_names or {}))
+    signatures = minhash_signatures(store.counts, num_perm=num_perm)
+    pairs, similarity = similar_pairs(signatures, threshold, bands, max_bucket_size, min_tokens, store.counts)
+    runs = duplicate_runs(store.pages, pairs, similarity, min_pages, max_gap, column_names)
+    pages = store.pages.reset_index(drop=True)
+    suggestions = pd.DataFrame({
+        'magazine_title': pages[column_names['magazine_title']].values[runs.row.values],
+        'htid': runs.htid.values,
+        'original_volumes': pages[column_names['original_volumes']].values[runs.row.values],
+        'type_of_page': 'duplicates',
+        'page_number': runs.start.values,
+        'notes': runs.start.astype(str).values + '-' + runs.end.astype(str).values,
+    })
+    for column in ['duplicate_of_htid', 'duplicate_of_start', 'duplicate_of_end', 'pages', 'similarity']:
+        suggestions[column] = runs[column].values
+    return suggestions
@@ -0,0 +1,53 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+# Fingerprints of the inputs to each stage of the pipeline so that outputs are only rebuilt when an
+# input actually changed. A stage's fingerprint combines its input data (annotation, metadata and
+# extracted features) with the source code that produces it, and is stored next to its output.
+
+def combine_fingerprints(*parts):
+    """Combine several fingerprints (or any strings) into a single fingerprint"""
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+def file_fingerprint(path):
+    """Fingerprint the contents of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def stat_fingerprint(paths):
+    '''Fingerprint a set of large files by their path, size and modification time. This is much cheaper than hashing the contents and is enough for files that the pipeline only ever replaces as a whole.'''
+    stats = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        stats.append(f'{path}:{stat.st_size}:{stat.st_mtime_ns}')
+    return combine_fingerprints(*stats)
+
+def frame_fingerprint(df):
+    """Fingerprint the contents of a dataframe"""
+    hashes = pd.util.hash_pandas_object(df, index=False).values
+    return combine_fingerprints(','.join(df.columns.astype(str)), hashlib.sha256(hashes.tobytes()).hexdigest())
+
+def code_fingerprint(*source_files):
+    """Fingerprint the source files that produce an output, so that code changes invalidate it"""
+    return combine_fingerprints(*[file_fingerprint(source_file) for source_file in source_files])
+
+def fingerprint_path(output_path):
+    """Get the path of the file that stores the fingerprint of an output"""
+    return os.path.splitext(output_path.rstrip('/'))[0] + '.fingerprint.json'
+
+def is_up_to_date(output_path, fingerprint):
+    """Check that an output exists and was built from inputs with the given fingerprint"""
+    if not (os.path.exists(output_path) and os.path.exists(fingerprint_path(output_path))):
+        return False
+    with open(fingerprint_path(output_path)) as f:
+        return json.load(f).get('fingerprint') == fingerprint
+
+def record_fingerprint(output_path, fingerprint):
+    """Store the fingerprint of the inputs an output was built from"""
+    with open(fingerprint_path(output_path), 'w') as f:
+        json.dump({'fingerprint': fingerprint}, f)
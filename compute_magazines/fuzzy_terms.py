@@ -0,0 +1,107 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import Levenshtein
+from . import array_files
+from .array_files import save_arrays, load_arrays
+from .fingerprints import combine_fingerprints, frame_fingerprint, code_fingerprint, is_up_to_date, record_fingerprint
+
+ARRAY_FILES = ['delete_hashes', 'delete_tokens']
+# Any change to the code that builds or saves the index invalidates it
+CODE_VERSION = code_fingerprint(os.path.abspath(__file__), array_files.__file__)
+
+def get_deletes(word, max_distance):
+    """Get the word and every string obtained by deleting up to max_distance of its characters"""
+    deletes = {word}
+    edits = {word}
+    for _ in range(max_distance):
+        edits = {edit[:i] + edit[i + 1:] for edit in edits for i in range(len(edit))}
+        deletes |= edits
+    return deletes
+
+def hash_strings(strings):
+    return pd.util.hash_array(np.asarray(strings, dtype=object), categorize=False).astype(np.int64)
+
+class FuzzyTermIndex:
+    """Symmetric delete index over a vocabulary: the hashes of every token prefix with up to max_distance characters deleted, sorted, with their token ids"""
+
+    def __init__(self, vocabulary, max_distance, prefix_length, arrays):
+        self.vocabulary = np.asarray(vocabulary, dtype=object)
+        self.vocabulary_index = pd.Index(self.vocabulary)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        for name in ARRAY_FILES:
+            setattr(self, name, arrays[name])
+
+    def save(self, path):
+        """Save the index to a directory"""
+        metadata = {'vocabulary': list(self.vocabulary), 'max_distance': self.max_distance, 'prefix_length': self.prefix_length}
+        save_arrays(path, {name: getattr(self, name) for name in ARRAY_FILES}, metadata)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load an index from a directory, memory mapping the deletes"""
+        metadata, arrays = load_arrays(path, ARRAY_FILES, mmap_mode)
+        return cls(metadata['vocabulary'], metadata['max_distance'], metadata['prefix_length'], arrays)
+
+    def __contains__(self, token):
+        return self.vocabulary_index.get_indexer([token])[0] >= 0
+
+    def lookup(self, term, max_distance=None):
+        '''Get every token within max_distance edits of term (at most the distance the index was built with) as a dataframe of token and distance, closest first.'''
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        query_hashes = hash_strings(list(get_deletes(term[:self.prefix_length], max_distance)))
+        starts = np.searchsorted(self.delete_hashes, query_hashes, side='left')
+        ends = np.searchsorted(self.delete_hashes, query_hashes, side='right')
+        candidates = np.unique(np.concatenate([np.asarray(self.delete_tokens[start:end]) for start, end in zip(starts, ends)] + [np.zeros(0, dtype=np.int32)]))
+        tokens = self.vocabulary[candidates]
+        distances = np.array([Levenshtein.distance(term, token) for token in tokens], dtype=np.int64)
+        matches = pd.DataFrame({'token': tokens, 'distance': distances})
+        matches = matches[matches.distance <= max_distance]
+        return matches.sort_values(by=['distance', 'token']).reset_index(drop=True)
+
+    def split_variants(self, term):
+        """Get the ways term can be split into two tokens that are both in the vocabulary, written as a space separated bigram"""
+        splits = [(term[:i], term[i:]) for i in range(2, len(term) - 1)]
+        if len(splits) == 0:
+            return []
+        known = self.vocabulary_index.get_indexer([token for split in splits for token in split]).reshape(-1, 2) >= 0
+        return [' '.join(split) for split, is_known in zip(splits, known.all(axis=1)) if is_known]
+
+def build_fuzzy_index(vocabulary, max_distance=2, prefix_length=7):
+    '''Build a FuzzyTermIndex over a vocabulary (for example TermIndex.vocabulary, DocumentStore.vocabulary or TokenArrays.tokens.terms). Only the first prefix_length characters of each token are indexed, which keeps the number of deletes per token small.'''
+    vocabulary = pd.unique(pd.Series(vocabulary, dtype=object).astype(str))
+    delete_strings, delete_tokens = [], []
+    for token_id, token in enumerate(vocabulary):
+        deletes = get_deletes(token[:prefix_length], max_distance)
+        delete_strings.extend(deletes)
+        delete_tokens.extend([token_id] * len(deletes))
+    delete_hashes = hash_strings(delete_strings)
+    order = np.argsort(delete_hashes, kind='stable')
+    arrays = {'delete_hashes': delete_hashes[order], 'delete_tokens': np.asarray(delete_tokens, dtype=np.int32)[order]}
+    return FuzzyTermIndex(list(vocabulary), max_distance, prefix_length, arrays)
+
+def get_fuzzy_index(index_path, vocabulary=None, **kwargs):
+    '''Load the fuzzy index from index_path, building it from vocabulary and saving it first if it does not exist or was built from a different vocabulary, options or code. Without a vocabulary an existing index is loaded as it is.'''
+    if vocabulary is None:
+        return FuzzyTermIndex.load(index_path)
+    fingerprint = combine_fingerprints(CODE_VERSION, frame_fingerprint(pd.DataFrame({'token': pd.Series(vocabulary, dtype=object).astype(str)})), json.dumps(kwargs, sort_keys=True))
+    if not (os.path.exists(os.path.join(index_path, 'metadata.json')) and is_up_to_date(index_path, fingerprint)):
+        build_fuzzy_index(vocabulary, **kwargs).save(index_path)
+        record_fingerprint(index_path, fingerprint)
+    return FuzzyTermIndex.load(index_path)
+
+def term_distance(term, max_distance):
+    """Allow fewer edits for short terms, one per four characters, since one edit of a short word is usually another word"""
+    return min(max_distance, len(term) // 4)
+
+def expand_terms(index, terms, max_distance=2, splits=True):
+    '''Expand every term to its OCR variants: the tokens of the corpus within term_distance edits and, with `splits`, the term split into two known tokens of at least two characters. Returns a dict from each term to its variants, starting with the term itself, which can be passed as `variants` to the coverage functions.'''
+    variants = {}
+    for term in terms:
+        term_variants = [term] + [token for token in index.lookup(term, term_distance(term, max_distance)).token if token != term]
+        if splits:
+            term_variants.extend(index.split_variants(term))
+        variants[term] = term_variants
+    return variants
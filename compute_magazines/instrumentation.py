@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import logging
+import cProfile
+import resource
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+# Stage level instrumentation for the pipeline. Each stage (fetch, tokenlist, merge, write, load,
+# aggregate...) of each volume records its duration, row count, bytes written and memory, and is
+# emitted as a structured (JSON) log line. Events can be summarized per stage or per volume.
+# Setting HTRC_PROFILE_HTID (and optionally HTRC_PROFILE_DIR) runs that volume under cProfile.
+
+logger = logging.getLogger('htrc_periodicals')
+PROFILE_HTID_VARIABLE = 'HTRC_PROFILE_HTID'
+PROFILE_DIR_VARIABLE = 'HTRC_PROFILE_DIR'
+
+def get_peak_rss_mb():
+    """Get the memory high-water mark of this process"""
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return round(peak_rss / 1024 ** 2, 1)
+
+class Instrumentation:
+    '''Collects stage events. Events from worker processes are plain dicts, so workers can collect them without logging (log=False), return them and have the parent add them with `extend`.'''
+
+    def __init__(self, log=True):
+        self.events = []
+        self.log = log
+        self.lock = threading.Lock()
+
+    def record(self, event):
+        """Add a finished event and log it"""
+        with self.lock:
+            self.events.append(event)
+        if self.log:
+            logger.info(json.dumps(event, default=str))
+
+    def extend(self, events):
+        for event in events:
+            self.record(event)
+
+    @contextmanager
+    def stage(self, name, htid=None, **fields):
+        '''Time a stage. The yielded event can be updated with rows and bytes_written (or anything else) inside the block. Failed stages are recorded with their error before the exception is raised again.'''
+        event = {'stage': name, 'htid': htid, 'rows': None, 'bytes_written': None, 'error': None}
+        event.update(fields)
+        start = time.perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event['error'] = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            event['seconds'] = round(time.perf_counter() - start, 4)
+            event['peak_rss_mb'] = get_peak_rss_mb()
+            event['pid'] = os.getpid()
+            self.record(event)
+
+    def to_df(self):
+        return pd.DataFrame(self.events, columns=['stage', 'htid', 'seconds', 'rows', 'bytes_written', 'peak_rss_mb', 'error', 'pid'])
+
+    def summary(self):
+        """Summarize the events per stage: count, total and slowest time, rows, bytes and memory high-water mark"""
+        events = self.to_df()
+        return events.groupby('stage').agg(volumes=('htid', 'nunique'), calls=('seconds', 'size'), total_seconds=('seconds', 'sum'), mean_seconds=('seconds', 'mean'), max_seconds=('seconds', 'max'), rows=('rows', 'sum'), bytes_written=('bytes_written', 'sum'), peak_rss_mb=('peak_rss_mb', 'max'), errors=('error', 'count')).sort_values(by='total_seconds', ascending=False).reset_index()
+
+    def slowest_volumes(self, n=10):
+        """Get the volumes with the most total time across all their stages"""
+        events = self.to_df()
+        return events.groupby('htid')['seconds'].sum().sort_values(ascending=False).head(n).reset_index()
+
+    def write_report(self, path):
+        '''Write all the events, the per-stage summary and the slowest volumes to a JSON report.'''
+        report = {'events': self.events, 'summary': self.summary().to_dict('records'), 'slowest_volumes': self.slowest_volumes().to_dict('records')}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+# Shared instrumentation for the current process
+instrumentation = Instrumentation()
+
+def stage(name, htid=None, **fields):
+    """Time a stage with the shared instrumentation"""
+    return instrumentation.stage(name, htid=htid, **fields)
+
+def configure_logging(log_file=None, level=logging.INFO):
+    """Emit the stage events as one JSON object per line, to a file or stderr"""
+    handler = logging.FileHandler(log_file) if log_file is not None else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+def enable_profiling(htid, profile_dir='.'):
+    """Profile a single htid in this process and any worker processes started after this"""
+    os.environ[PROFILE_HTID_VARIABLE] = htid
+    os.environ[PROFILE_DIR_VARIABLE] = profile_dir
+
+@contextmanager
+def profile_volume(htid):
+    '''Run the block under cProfile if htid is the volume selected with HTRC_PROFILE_HTID, writing <htid>.prof to HTRC_PROFILE_DIR.'''
+    if os.environ.get(PROFILE_HTID_VARIABLE) != htid:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_dir = os.environ.get(PROFILE_DIR_VARIABLE, '.')
+        if not os.path.exists(profile_dir):
+            os.makedirs(profile_dir)
+        profile_path = os.path.join(profile_dir, htid.replace('/', '_').replace(':', '_') + '.prof')
+        profiler.dump_stats(profile_path)
+        logger.info(json.dumps({'profile': profile_path, 'htid': htid}))
@@ -2,21 +2,32 @@ import os
 import pandas as pd
 import warnings
 warnings.filterwarnings('ignore')
+from .volume_store import read_volumes
+from . import document_store
+from .document_store import DocumentStore, build_document_store, ISSUE_COLUMNS
+from . import aggregate_cube
+from .aggregate_cube import build_cube, cube_terms
+from . import page_numbers
+from .page_numbers import infer_page_numbers
+from . import token_arrays
+from .token_arrays import TokenArrays, build_token_arrays
+from .term_series import TermSeries
+from .instrumentation import stage
+from .directory_resolver import get_metadata_files, get_directory_mapping
+from .fingerprints import combine_fingerprints, file_fingerprint, stat_fingerprint, code_fingerprint, is_up_to_date, record_fingerprint
 
-def cut_scanners(rows):
-    first_page = rows.loc[ (rows.type_of_page == 'split_issue')].page_number.values.tolist()
-    print(first_page)
-    if len(first_page) > 0:
-        first_page = first_page[0]
-        pages = rows.loc[rows.page_number > first_page]
-    else:
-        # first_page = rows.loc[(rows.type_of_page == 'toc')].page_number.values.tolist()[0]
-        pages = rows
-    return pages
+COMBINED_COLUMN_NAMES = {'title': 'ht_generated_title', 'magazine_title': 'cleaned_magazine_title', 'link': 'hdl_link', 'volumes': 'volume_number', 'original_volumes': 'cleaned_volume'}
+# Any change to the code in this file invalidates the datasets it builds
+CODE_VERSION = code_fingerprint(os.path.abspath(__file__))
+COMBINED_CATEGORICAL_COLUMNS = ['token', 'pos', 'section', 'type_of_page', 'notes', 'dates', 'cleaned_magazine_title', 'ht_generated_title', 'htid', 'hdl_link', 'cleaned_volume', 'start_issue', 'end_issue']
+
+def cut_scanners(df):
+    """Drop the pages of each issue up to and including its first split_issue page"""
+    first_page = df.page_number.where(df.type_of_page == 'split_issue').groupby(df.start_issue).transform('first')
+    return df[df.start_issue.notna() & (first_page.isna() | (df.page_number > first_page))]
 
 def clean_df(df):
-    df = df.groupby('start_issue', as_index=False).apply(cut_scanners).reset_index()
-    df = df.loc[:, ~df.columns.str.contains('^level')]
+    df = cut_scanners(df).sort_values(by='start_issue', kind='stable').reset_index(drop=True)
     return df
 
 def clean_arab_observer_df(arabobserver_df):
@@ -33,59 +44,259 @@ def clean_afro_asian_df(afroasian_df):
     afroasian_df.loc[(afroasian_df.start_issue == '1967-09-01') & (afroasian_df.page_number == 4), 'type_of_page'] = 'cover_page'
     return afroasian_df
 
-def get_full_combined_dataset(output_path, output_directory):
-    if os.path.exists(output_path):
-        df = pd.read_csv(output_path)
+def get_volume_files(output_directory):
+    """Get the paths of all the per-volume csvs, skipping the combined files in the top level directory"""
+    volume_files = []
+    for root, dirs, files in os.walk(output_directory):
+        for f in files:
+            if ('.csv' in f) and (root != output_directory):
+                volume_files.append(os.path.join(root, f))
+    return volume_files
+
+def clean_volume_df(df, file_name):
+    """Apply the magazine specific fixups based on the volume file name"""
+    if "Arab_Observer" in file_name:
+        df = clean_arab_observer_df(df)
+    if "Afro_Asian_Bulletin" in file_name:
+        df = clean_afro_asian_df(df)
+    return df
+
+def downcast_df(df):
+    """Shrink a chunk of the combined dataset by converting repeated strings to categoricals and numbers to the smallest dtype that holds them"""
+    for col in df.columns:
+        if col in COMBINED_CATEGORICAL_COLUMNS:
+            df[col] = df[col].astype('category')
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif pd.api.types.is_float_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='float')
+    return df
+
+def read_combined_dataset(output_path):
+    """Read the combined csv with categorical columns so that it takes a fraction of the memory of plain object columns"""
+    columns = pd.read_csv(output_path, nrows=0).columns
+    dtypes = {col: 'category' for col in COMBINED_CATEGORICAL_COLUMNS if col in columns}
+    df = pd.read_csv(output_path, dtype=dtypes, parse_dates=['datetime'] if 'datetime' in columns else False)
+    return downcast_df(df)
+
+def stream_combined_dataset(output_path, output_directory, chunksize=500000):
+    '''Build the combined csv one chunk at a time so that only a single chunk is ever in memory. Each chunk is cleaned, renamed, downcast and appended to the output, which is only moved into place once it is complete.'''
+    volume_files = get_volume_files(output_directory)
+    # Volumes can have different annotation columns, so every chunk is aligned to the union of all of them
+    columns = []
+    for volume_file in volume_files:
+        for col in pd.read_csv(volume_file, nrows=0).rename(columns=COMBINED_COLUMN_NAMES).columns:
+            if col not in columns:
+                columns.append(col)
+    columns.append('datetime')
+
+    partial_path = output_path + '.partial'
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    write_header = True
+    for volume_file in volume_files:
+        with stage('load', os.path.basename(volume_file), streaming=True) as event:
+            event['rows'] = 0
+            for df in pd.read_csv(volume_file, chunksize=chunksize, low_memory=False):
+                df = clean_volume_df(df, os.path.basename(volume_file))
+                df = df.rename(columns=COMBINED_COLUMN_NAMES)
+                df['datetime'] = pd.to_datetime(df.start_issue, format='%Y-%m-%d', errors='coerce')
+                df = downcast_df(df.reindex(columns=columns))
+                df.to_csv(partial_path, mode='w' if write_header else 'a', header=write_header, index=False)
+                write_header = False
+                event['rows'] += len(df)
+    os.replace(partial_path, output_path)
+
+def get_combined_fingerprint(output_path, volume_files):
+    '''Fingerprint the combined dataset from its volume files. If the volume files are not available locally, an existing combined dataset is treated as up to date.'''
+    if (len(volume_files) == 0) and os.path.exists(output_path):
+        return None
+    return combine_fingerprints(CODE_VERSION, stat_fingerprint(volume_files))
+
+def is_stage_up_to_date(output_path, fingerprint):
+    """Check if an output can be reused, either because its inputs are unchanged or because they cannot be checked"""
+    return os.path.exists(output_path) if fingerprint is None else is_up_to_date(output_path, fingerprint)
+
+def get_full_combined_dataset(output_path, output_directory, streaming=False, chunksize=500000):
+    '''Load the combined dataset of all volumes, building it from the per-volume csvs if it does not exist yet or if any volume file changed since it was built. With `streaming` the dataset is built in chunks and read back with categorical columns, so peak memory stays close to the compact size of the corpus.'''
+    volume_files = get_volume_files(output_directory)
+    fingerprint = get_combined_fingerprint(output_path, volume_files)
+    if streaming:
+        if not is_stage_up_to_date(output_path, fingerprint):
+            stream_combined_dataset(output_path, output_directory, chunksize=chunksize)
+            record_fingerprint(output_path, fingerprint)
+        with stage('load_combined') as event:
+            df = read_combined_dataset(output_path)
+            event['rows'] = len(df)
+        return df
+
+    if is_stage_up_to_date(output_path, fingerprint):
+        with stage('load_combined') as event:
+            df = pd.read_csv(output_path)
+            event['rows'] = len(df)
 
     else:
         dfs = []
-        for root, dirs, files in os.walk(output_directory):
-            print(root)
-            for f in files:
-                if ('.csv' in f) and (root != output_directory):
-                    df = pd.read_csv(os.path.join(root, f), low_memory=False)
-                    if "Arab_Observer" in f:
-                        df = clean_arab_observer_df(df)
-                    if "Afro_Asian_Bulletin" in f:
-                        df = clean_afro_asian_df(df)
-
-                    dfs.append(df)
-        df = pd.concat(dfs)
-        df = df.rename(columns={'title': 'ht_generated_title', 'magazine_title': 'cleaned_magazine_title', 'link': 'hdl_link', 'volumes': 'volume_number', 'original_volumes': 'cleaned_volume'})
+        for volume_file in volume_files:
+            with stage('load', os.path.basename(volume_file)) as event:
+                df = pd.read_csv(volume_file, low_memory=False)
+                df = clean_volume_df(df, os.path.basename(volume_file))
+                event['rows'] = len(df)
+            dfs.append(df)
+        with stage('aggregate', output=output_path) as event:
+            df = pd.concat(dfs)
+            df = df.rename(columns=COMBINED_COLUMN_NAMES)
+            df['datetime'] = pd.to_datetime(df.start_issue, format='%Y-%m-%d', errors='coerce')
+            event['rows'] = len(df)
+        with stage('write', output=output_path) as event:
+            df.to_csv(output_path, index=False)
+            event['rows'] = len(df)
+            event['bytes_written'] = os.path.getsize(output_path)
+        record_fingerprint(output_path, fingerprint)
+    return df
+
+def apply_magazine_fixups(df, magazine_title):
+    '''Apply the manual corrections for specific magazines. Categorical columns get the corrected values added as categories first.'''
+    magazine_title = magazine_title.lower()
+    if ('arab_observer' not in magazine_title) and ('afro_asian_bulletin' not in magazine_title):
+        return df
+    for col, values in {'type_of_page': ['cover_page'], 'notes': ['Not actually a cover']}.items():
+        if (col in df.columns) and (df[col].dtype.name == 'category'):
+            df[col] = df[col].cat.add_categories([v for v in values if v not in df[col].cat.categories])
+    if 'arab_observer' in magazine_title:
+        df = clean_arab_observer_df(df)
+    if 'afro_asian_bulletin' in magazine_title:
+        df = clean_afro_asian_df(df)
+    return df
+
+def get_combined_dataset_from_store(store_path, columns=None, magazines=None, start_date=None, end_date=None):
+    '''Load the combined dataset from the partitioned Parquet store instead of the per-volume csvs. Only the requested columns, magazines and issue date range (on start_issue) are read. Columns use the store names, the renamed columns are returned like get_full_combined_dataset.'''
+    if (columns is not None) and ('magazine_title' not in columns):
+        columns = list(columns) + ['magazine_title']
+    df = read_volumes(store_path, columns=columns, magazines=magazines, start_date=start_date, end_date=end_date)
+    if all(col in df.columns for col in ['start_issue', 'page_number', 'notes', 'type_of_page']):
+        dfs = [apply_magazine_fixups(magazine_df, magazine_title) for magazine_title, magazine_df in df.groupby('magazine_title')]
+        df = pd.concat(dfs) if len(dfs) > 0 else df
+    df = df.rename(columns=COMBINED_COLUMN_NAMES)
+    if 'start_issue' in df.columns:
         df['datetime'] = pd.to_datetime(df.start_issue, format='%Y-%m-%d', errors='coerce')
-        df.to_csv(output_path, index=False)
     return df
 
 def get_serial_htids(output_path):
-    if os.path.exists(output_path):
+    '''Load the htids of every metadata file, rebuilding them if any metadata file changed since they were built. Magazine titles come from the shared directory mapping.'''
+    metadata_files = get_metadata_files()
+    fingerprint = combine_fingerprints(CODE_VERSION, *[file_fingerprint(f) for f in metadata_files]) if len(metadata_files) > 0 else None
+    if is_stage_up_to_date(output_path, fingerprint):
         serial_htid_df = pd.read_csv(output_path)
     else:
-        dir_list = [subdir for subdir, _, _ in os.walk('../ht_ef_datasets/')]
-        annotated_df = pd.read_csv('../generate_hathitrust_data/annotation_metadata_mapping.csv')
         dfs = []
-        for subdir, dirs, files in os.walk('../metadatas'):
-                for f in files:
-                    if '.csv' in f:
-                        annotation_row = annotated_df.loc[annotated_df['metadata_file'] == subdir + '/' + f].copy()
-                        file_name = f.split('.')[0]
-                        filenames = file_name.split('_')
-                        filenames = [ fi for fi in filenames if fi.isdigit() == False]
-
-                        filenames = '_'.join(filenames)
-                        md = pd.read_csv(subdir+ '/'+f, encoding = "utf-8")
-                        md['magazine_title'] = filenames
-                        dfs.append(md)
+        for row in get_directory_mapping().to_dict('records'):
+            md = pd.read_csv(row['metadata_file'], encoding = "utf-8")
+            md['magazine_title'] = row['file_name']
+            dfs.append(md)
         serial_htid_df = pd.concat(dfs)
         serial_htid_df.rename(columns={'vol_id': 'htid'}, inplace=True)
         serial_htid_df.to_csv(output_path, index=False)
+        record_fingerprint(output_path, fingerprint)
     return serial_htid_df
 
+def get_uncombined_fingerprint(uncombined_df_path, *source_files):
+    """Fingerprint a dataset derived from the combined dataset"""
+    if not os.path.exists(uncombined_df_path):
+        return None
+    return combine_fingerprints(CODE_VERSION, code_fingerprint(*source_files), stat_fingerprint([uncombined_df_path]))
+
 def get_combined_issues(output_path, uncombined_df_path):
-    if os.path.exists(output_path):
-        issue_df = pd.read_csv(output_path)
+    """Load the pages of the combined dataset with their tokens joined into text, rebuilding them only if the combined dataset or this code changed"""
+    fingerprint = get_uncombined_fingerprint(uncombined_df_path)
+    if is_stage_up_to_date(output_path, fingerprint):
+        with stage('load_issues', output=output_path) as event:
+            issue_df = pd.read_csv(output_path)
+            event['rows'] = len(issue_df)
     else:
         df = pd.read_csv(uncombined_df_path, low_memory=False)
         df.token = df.token.astype(str)
         df.volume_number = df.volume_number.fillna(0)
-        issue_df = df.groupby(['cleaned_magazine_title', 'ht_generated_title', 'volume_number', 'htid', 'hdl_link','cleaned_volume', 'start_issue', 'end_issue', 'datetime','dates', 'issue_number', 'type_of_page', 'sequence'], as_index = False).agg({'token': ' '.join, 'pos': list, 'count': list, 'section': list})
-    return issue_df
\ No newline at end of file
+        with stage('aggregate', output=output_path) as event:
+            issue_df = df.groupby(ISSUE_COLUMNS, as_index = False).agg({'token': ' '.join, 'pos': list, 'count': list, 'section': list})
+            event['rows'] = len(issue_df)
+        with stage('write', output=output_path) as event:
+            issue_df.to_csv(output_path + '.partial', index=False)
+            os.replace(output_path + '.partial', output_path)
+            event['bytes_written'] = os.path.getsize(output_path)
+        record_fingerprint(output_path, fingerprint)
+    return issue_df
+
+def get_document_store(output_path, uncombined_df_path):
+    '''Load the page level document store (page metadata, vocabulary and sparse page by term counts), building it from the combined dataset if it does not exist yet. Unlike get_combined_issues no page text is joined, use DocumentStore.texts when text is needed.'''
+    fingerprint = get_uncombined_fingerprint(uncombined_df_path, document_store.__file__)
+    if os.path.exists(os.path.join(output_path, 'vocabulary.json')) and is_stage_up_to_date(output_path, fingerprint):
+        store = DocumentStore.load(output_path)
+    else:
+        df = pd.read_csv(uncombined_df_path, low_memory=False)
+        df.volume_number = df.volume_number.fillna(0)
+        store = build_document_store(df)
+        store.save(output_path)
+        record_fingerprint(output_path, fingerprint)
+    return store
+
+def get_aggregate_cube(output_path, uncombined_df_path, terms=None):
+    '''Load the page level aggregate cube used by the charts, building it from the combined dataset if it does not exist, is out of date, or is missing any of the terms. A rebuild keeps the terms already in the cube.'''
+    fingerprint = get_uncombined_fingerprint(uncombined_df_path, aggregate_cube.__file__)
+    terms = terms or []
+    cube = None
+    if is_stage_up_to_date(output_path, fingerprint):
+        with stage('load_cube', output=output_path) as event:
+            cube = pd.read_parquet(output_path)
+            event['rows'] = len(cube)
+    if (cube is None) or (not set(terms) <= set(cube_terms(cube))):
+        existing_terms = cube_terms(cube) if cube is not None else []
+        with stage('aggregate', output=output_path) as event:
+            cube = build_cube(uncombined_df_path, existing_terms + list(terms))
+            event['rows'] = len(cube)
+        with stage('write', output=output_path) as event:
+            cube.to_parquet(output_path + '.partial', index=False)
+            os.replace(output_path + '.partial', output_path)
+            event['bytes_written'] = os.path.getsize(output_path)
+        record_fingerprint(output_path, fingerprint)
+    return cube
+
+def get_page_numbers(output_path, uncombined_df_path, workers=1):
+    '''Load the inferred printed page number of every page of every volume, building it from the digit tokens of the combined dataset if it does not exist or is out of date. The table can be passed to merge_datasets.'''
+    fingerprint = get_uncombined_fingerprint(uncombined_df_path, page_numbers.__file__)
+    if is_stage_up_to_date(output_path, fingerprint):
+        return pd.read_parquet(output_path)
+    df = pd.read_csv(uncombined_df_path, usecols=['htid', 'sequence', 'token'], low_memory=False)
+    with stage('page_numbers', output=output_path) as event:
+        page_number_df = infer_page_numbers(df, workers=workers)
+        event['rows'] = len(page_number_df)
+    page_number_df.to_parquet(output_path + '.partial', index=False)
+    os.replace(output_path + '.partial', output_path)
+    record_fingerprint(output_path, fingerprint)
+    return page_number_df
+
+def read_volume_tokens(volume_files):
+    """Read the token columns of each volume csv in turn, keeping tokens like "nan" or "null" as strings"""
+    for volume_file in volume_files:
+        with stage('load', os.path.basename(volume_file)) as event:
+            df = pd.read_csv(volume_file, usecols=['magazine_title', 'htid', 'sequence', 'token', 'pos', 'count', 'section'], dtype={'token': str, 'pos': str, 'section': str}, keep_default_na=False, na_values={'sequence': [''], 'count': ['']})
+            event['rows'] = len(df)
+        yield df
+
+def get_token_arrays(output_path, output_directory):
+    '''Load the memory-mapped integer token arrays of every volume, building them from the per-volume csvs if they do not exist or are out of date. Tokens, POS tags and sections are interned in global vocabularies.'''
+    volume_files = sorted(get_volume_files(output_directory))
+    fingerprint = get_combined_fingerprint(output_path, volume_files)
+    if fingerprint is not None:
+        fingerprint = combine_fingerprints(fingerprint, code_fingerprint(token_arrays.__file__))
+    if os.path.exists(os.path.join(output_path, 'metadata.json')) and is_stage_up_to_date(output_path, fingerprint):
+        return TokenArrays(output_path)
+    with stage('intern', output=output_path) as event:
+        arrays = build_token_arrays(output_path, read_volume_tokens(volume_files))
+        event['rows'] = int(arrays.offsets[-1])
+    record_fingerprint(output_path, fingerprint)
+    return arrays
+
+def get_term_series(output_path, uncombined_df_path):
+    """Get per issue term counts over the page level document store, building the store if it does not exist or is out of date"""
+    return TermSeries(get_document_store(output_path, uncombined_df_path))
@@ -0,0 +1,136 @@
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn import metrics
+from .document_store import DocumentStore
+
+# Cover/content/toc page classifier from the segmentation notebook, trained on the sparse page by term
+# counts of a DocumentStore instead of dense tf-idf arrays. Pages are scored in batches of rows of the
+# memory-mapped count matrix, optionally across several processes, and the predictions are written to
+# the store's page table next to type_of_page so new magazines can be pre-annotated.
+
+PAGE_TYPES = ['cover_page', 'content', 'toc']
+PREDICTION_COLUMN = 'predicted_type_of_page'
+MODEL_FILE = 'page_classifier.joblib'
+
+def page_labels(pages):
+    """Get the page type of every page, unannotated pages are content"""
+    return pages.type_of_page.astype(object).fillna('content')
+
+def document_frequency_mask(counts, max_df):
+    """Select the terms that appear in at most max_df (a proportion) of the pages, like TfidfVectorizer(max_df=...)"""
+    document_frequency = np.bincount(np.asarray(counts.indices), minlength=counts.shape[1])
+    return document_frequency <= max_df * counts.shape[0]
+
+class PageClassifier:
+    '''Tf-idf and logistic regression over a fixed vocabulary. Count matrices with another vocabulary are aligned to it, so a classifier trained on one store can score any other.'''
+
+    def __init__(self, vocabulary, tfidf, model):
+        self.vocabulary = np.asarray(vocabulary, dtype=object)
+        self.tfidf = tfidf
+        self.model = model
+
+    @property
+    def classes(self):
+        return list(self.model.classes_)
+
+    def save(self, path):
+        """Save the classifier to a directory"""
+        if not os.path.exists(path):
+            os.makedirs(path)
+        joblib.dump({'vocabulary': list(self.vocabulary), 'tfidf': self.tfidf, 'model': self.model}, os.path.join(path, MODEL_FILE))
+
+    @classmethod
+    def load(cls, path):
+        saved = joblib.load(os.path.join(path, MODEL_FILE))
+        return cls(saved['vocabulary'], saved['tfidf'], saved['model'])
+
+    def column_indexer(self, vocabulary):
+        """Map the columns of a vocabulary to the columns of the classifier (-1 for unknown terms)"""
+        return pd.Index(self.vocabulary).get_indexer(np.asarray(vocabulary, dtype=object))
+
+    def features(self, counts, indexer=None):
+        '''Get the sparse tf-idf features of a batch of count rows. `indexer` (from column_indexer) maps the columns of counts to the classifier vocabulary, without it they must already match.'''
+        counts = sparse.csr_matrix(counts, dtype=np.float64)
+        if indexer is not None:
+            counts = counts.tocoo()
+            columns = indexer[counts.col]
+            known = columns >= 0
+            counts = sparse.csr_matrix((counts.data[known], (counts.row[known], columns[known])), shape=(counts.shape[0], len(self.vocabulary)))
+        return self.tfidf.transform(counts)
+
+    def predict_proba(self, counts, indexer=None):
+        return self.model.predict_proba(self.features(counts, indexer))
+
+def train_page_classifier(store, max_df=0.3, test_size=0.3, random_state=0, page_types=PAGE_TYPES, **model_kwargs):
+    '''Train a classifier on the annotated pages of a DocumentStore, keeping test_size of them for validation. Returns the classifier and a classification report of the validation pages.'''
+    labels = page_labels(store.pages)
+    rows = np.flatnonzero(labels.isin(page_types).values)
+    counts = store.counts[rows]
+    columns = np.flatnonzero(document_frequency_mask(counts, max_df))
+    counts = counts[:, columns]
+
+    x_train, x_val, y_train, y_val = train_test_split(counts, labels.values[rows], test_size=test_size, random_state=random_state)
+    tfidf = TfidfTransformer().fit(x_train)
+    model = LogisticRegression(random_state=random_state, max_iter=1000, **model_kwargs)
+    model.fit(tfidf.transform(x_train), y_train)
+    classifier = PageClassifier(store.vocabulary[columns], tfidf, model)
+
+    y_pred = model.predict(tfidf.transform(x_val))
+    report = metrics.classification_report(y_val, y_pred, output_dict=True, zero_division=0)
+    return classifier, report
+
+# Classifier and store of each worker process, loaded once by init_worker
+worker_state = {}
+
+def init_worker(store_path, classifier_path):
+    store = DocumentStore.load(store_path)
+    classifier = PageClassifier.load(classifier_path)
+    worker_state.update(store=store, classifier=classifier, indexer=classifier.column_indexer(store.vocabulary))
+
+def score_rows(start, end, store=None, classifier=None, indexer=None):
+    """Get the class probabilities of rows start to end of a store, using the worker's store and classifier if none are passed"""
+    if store is None:
+        store, classifier, indexer = worker_state['store'], worker_state['classifier'], worker_state['indexer']
+    return classifier.predict_proba(store.counts[start:end], indexer)
+
+def classify_pages(store_path, classifier_path, batch_size=10000, workers=1):
+    '''Score every page of a saved DocumentStore in batches of batch_size rows. With several workers each process memory-maps the store and the batches are scored in parallel. Returns the page table with the predicted page type and the probability of each type.'''
+    store = DocumentStore.load(store_path)
+    classifier = PageClassifier.load(classifier_path)
+    batches = [(start, min(start + batch_size, len(store.pages))) for start in range(0, len(store.pages), batch_size)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(store_path, classifier_path)) as executor:
+            probabilities = list(executor.map(score_rows, *zip(*batches))) if batches else []
+    else:
+        indexer = classifier.column_indexer(store.vocabulary)
+        probabilities = [score_rows(start, end, store, classifier, indexer) for start, end in batches]
+    probabilities = np.vstack(probabilities) if probabilities else np.zeros((0, len(classifier.classes)))
+    return add_predictions(store.pages, probabilities, classifier.classes)
+
+def add_predictions(pages, probabilities, classes):
+    """Insert the predicted page type and the probability of each type after type_of_page"""
+    pages = pages.drop(columns=[column for column in pages.columns if column == PREDICTION_COLUMN or column.startswith('proba_')])
+    position = pages.columns.get_loc('type_of_page') + 1
+    pages.insert(position, PREDICTION_COLUMN, np.asarray(classes, dtype=object)[probabilities.argmax(axis=1)] if len(probabilities) else [])
+    for i, page_type in enumerate(classes):
+        pages.insert(position + 1 + i, 'proba_' + page_type, probabilities[:, i])
+    return pages
+
+def write_predictions(store_path, pages):
+    '''Replace the page table of a saved DocumentStore with one that has predictions. Rebuilding the store drops them.'''
+    pages_path = os.path.join(store_path, 'pages.parquet')
+    pages.to_parquet(pages_path + '.partial', index=False)
+    os.replace(pages_path + '.partial', pages_path)
+
+def pre_annotate(store_path, classifier_path, batch_size=10000, workers=1):
+    """Classify every page of a saved DocumentStore and write the predictions to it"""
+    pages = classify_pages(store_path, classifier_path, batch_size, workers)
+    write_predictions(store_path, pages)
+    return pages
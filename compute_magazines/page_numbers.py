@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Inference of printed page numbers from the digit tokens of each volume, productionizing the
+# implied_zero analysis in Load_Data.ipynb. A digit token `number` on scan page `sequence` implies that
+# page numbering starts at implied_zero = sequence - number. For every volume a dynamic programming pass
+# over the scan pages finds the most likely implied_zero of each page: staying on the same offset
+# (diag) is cheap, shifting it by one (updown, an unnumbered plate or a skipped number) costs more, and
+# jumping anywhere (backpass, a new issue restarting its numbering) costs the most. The weights scale
+# the score carried over from the previous page, which is clamped at zero so that pages without numbers
+# (otherwise) cannot make a shift cheaper than staying.
+
+OTHERWISE = -1
+POINTS = 16
+DIAG = 0.995
+UPDOWN = 0.33
+BACKPASS_WEIGHT = 0.66
+# Numbers above the last sequence plus this margin are not page numbers (mostly years)
+MAX_NUMBER_MARGIN = 25
+PAGE_NUMBER_COLUMNS = ['htid', 'sequence', 'inferred_page_number', 'implied_zero', 'observed']
+
+def digit_tokens(df, token_column='token'):
+    """Get the htid, sequence and number of every digit token"""
+    tokens = df[token_column].astype(str)
+    is_number = (tokens.str.isdigit() & (tokens.str.len() <= 6)).values
+    digits = df.loc[is_number, ['htid', 'sequence']].copy()
+    digits['number'] = tokens[is_number].astype(int).values
+    digits['sequence'] = digits.sequence.astype(int)
+    return digits
+
+def emission_scores(sequences, numbers, max_sequence, margin=MAX_NUMBER_MARGIN, points=POINTS, otherwise=OTHERWISE):
+    '''Score every (sequence, offset) pair: points if the page has the number the offset implies, otherwise `otherwise`. Offsets run from -margin to max_sequence - 1 so that numbers 1 to max_sequence + margin are possible.'''
+    scores = np.full((max_sequence + 1, max_sequence + margin), otherwise, dtype=np.float64)
+    keep = (numbers >= 1) & (numbers <= max_sequence + margin) & (sequences >= 1) & (sequences <= max_sequence)
+    scores[sequences[keep], sequences[keep] - numbers[keep] + margin] = points
+    return scores
+
+def align_volume(sequences, numbers, max_sequence, margin=MAX_NUMBER_MARGIN, points=POINTS, otherwise=OTHERWISE, diag=DIAG, updown=UPDOWN, backpass_weight=BACKPASS_WEIGHT):
+    '''Find the most likely implied_zero of every page 1 to max_sequence of a volume from the sequences and numbers of its digit tokens. Each step of the pass is vectorized over all the offsets. Returns the implied_zero and whether the page itself shows its number.'''
+    sequences, numbers = np.asarray(sequences, dtype=np.int64), np.asarray(numbers, dtype=np.int64)
+    scores = emission_scores(sequences, numbers, max_sequence, margin, points, otherwise)
+    n_offsets = scores.shape[1]
+    offsets = np.arange(n_offsets)
+    pointers = np.zeros((max_sequence + 1, n_offsets), dtype=np.int64)
+    previous = np.zeros(n_offsets)
+    for sequence in range(1, max_sequence + 1):
+        # Candidate previous offsets: the same one, one lower, one higher, and the best of all. Ties go to
+        # staying, so offsets no number has supported yet keep their own offset.
+        carried = np.maximum(previous, 0)
+        up = np.concatenate([[-np.inf], carried[:-1]])
+        down = np.concatenate([carried[1:], [-np.inf]])
+        candidates = np.vstack([carried * diag, np.maximum(up, down) * updown, np.full(n_offsets, carried.max() * backpass_weight)])
+        choice = candidates.argmax(axis=0)
+        from_up = up >= down
+        pointers[sequence] = np.select([choice == 0, (choice == 1) & from_up, choice == 1], [offsets, offsets - 1, offsets + 1], carried.argmax())
+        previous = candidates[choice, offsets] + scores[sequence]
+    path = np.zeros(max_sequence + 1, dtype=np.int64)
+    path[max_sequence] = previous.argmax()
+    for sequence in range(max_sequence, 1, -1):
+        path[sequence - 1] = pointers[sequence, path[sequence]]
+    path = path[1:]
+    observed = scores[np.arange(1, max_sequence + 1), path] == points
+    return path - margin, observed
+
+def align_volume_frame(htid, sequences, numbers, max_sequence, weights):
+    """Align one volume and return its rows of the page number table"""
+    pages = np.arange(1, max_sequence + 1)
+    if len(numbers) == 0:
+        implied_zero, observed = np.zeros(max_sequence, dtype=np.int64), np.zeros(max_sequence, dtype=bool)
+        page_numbers = pd.array([pd.NA] * max_sequence, dtype='Int64')
+    else:
+        implied_zero, observed = align_volume(sequences, numbers, max_sequence, **weights)
+        page_numbers = pd.array(pages - implied_zero, dtype='Int64')
+        # Pages before the first numbered page (covers, front matter) have no printed number
+        page_numbers[pages - implied_zero < 1] = pd.NA
+    return pd.DataFrame({'htid': htid, 'sequence': pages, 'inferred_page_number': page_numbers, 'implied_zero': implied_zero, 'observed': observed})
+
+def infer_page_numbers(df, workers=1, token_column='token', **weights):
+    '''Build a sequence to printed page number table for every volume of a token level dataset (with htid, sequence and token columns). The digit tokens are split into numpy arrays per htid in one pass and the volumes are aligned in a process pool. The table has the columns of PAGE_NUMBER_COLUMNS and can be passed to merge_datasets.'''
+    max_sequences = df.groupby('htid', observed=True).sequence.max().astype(int)
+    digits = digit_tokens(df, token_column).sort_values(by=['htid', 'sequence'], kind='stable')
+    htids = digits.htid.astype(str).values
+    boundaries = np.flatnonzero(htids[1:] != htids[:-1]) + 1
+    starts = np.concatenate([[0], boundaries]) if len(htids) > 0 else []
+    volumes = dict(zip(htids[starts], zip(np.split(digits.sequence.values, boundaries), np.split(digits.number.values, boundaries))))
+    empty = np.zeros(0, dtype=np.int64)
+    tasks = [(htid, *volumes.get(str(htid), (empty, empty)), int(max_sequence), weights) for htid, max_sequence in max_sequences.items()]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            frames = list(executor.map(align_volume_frame, *zip(*tasks))) if tasks else []
+    else:
+        frames = [align_volume_frame(*task) for task in tasks]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=PAGE_NUMBER_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
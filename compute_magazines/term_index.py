@@ -0,0 +1,126 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from . import array_files
+from .array_files import save_arrays, load_arrays
+from .fingerprints import combine_fingerprints, frame_fingerprint, code_fingerprint, is_up_to_date, record_fingerprint
+
+PAGE_COLUMNS = ['magazine_title', 'datetime', 'htid', 'sequence']
+DEFAULT_COLUMN_NAMES = {'magazine_title': 'cleaned_magazine_title', 'datetime': 'datetime', 'htid': 'htid', 'sequence': 'sequence'}
+# Any change to the code that builds or saves the index invalidates it
+CODE_VERSION = code_fingerprint(os.path.abspath(__file__), array_files.__file__)
+ARRAY_FILES = ['offsets', 'posting_pages', 'posting_counts', 'page_magazines', 'page_datetimes', 'page_htids', 'page_sequences', 'page_totals']
+
+def get_ngrams(text, max_ngram):
+    """Get all the space separated n-grams of a page of text up to length max_ngram"""
+    words = str(text).split()
+    ngrams = list(words)
+    for n in range(2, max_ngram + 1):
+        ngrams.extend(' '.join(words[i:i+n]) for i in range(len(words) - n + 1))
+    return ngrams
+
+class TermIndex:
+    """Inverted index from terms to postings of (magazine, issue datetime, htid, sequence, count), sorted by term with an offsets array giving the slice of each term"""
+
+    def __init__(self, vocabulary, magazines, htids, arrays):
+        self.vocabulary = vocabulary
+        self.term_ids = {term: i for i, term in enumerate(vocabulary)}
+        self.magazines = np.asarray(magazines, dtype=object)
+        self.htids = np.asarray(htids, dtype=object)
+        for name in ARRAY_FILES:
+            setattr(self, name, arrays[name])
+        self._pages = None
+
+    def save(self, path):
+        """Save the index to a directory"""
+        metadata = {'vocabulary': list(self.vocabulary), 'magazines': list(self.magazines), 'htids': list(self.htids)}
+        save_arrays(path, {name: getattr(self, name) for name in ARRAY_FILES}, metadata)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load an index from a directory, memory mapping the postings"""
+        metadata, arrays = load_arrays(path, ARRAY_FILES, mmap_mode)
+        return cls(metadata['vocabulary'], metadata['magazines'], metadata['htids'], arrays)
+
+    def pages(self):
+        """Get the page table with the total number of words on each page"""
+        if self._pages is None:
+            self._pages = pd.DataFrame({
+                'magazine_title': self.magazines[self.page_magazines],
+                'datetime': pd.to_datetime(np.asarray(self.page_datetimes)),
+                'htid': self.htids[self.page_htids],
+                'sequence': np.asarray(self.page_sequences),
+                'page_total': np.asarray(self.page_totals),
+            })
+        return self._pages
+
+    def term_page_ids(self, term):
+        """Get the page ids and counts for a single term"""
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return np.asarray(self.posting_pages[start:end]), np.asarray(self.posting_counts[start:end])
+
+    def postings(self, terms):
+        """Get the postings of a list of terms as a dataframe with one row per term and page"""
+        page_ids, counts, term_labels = [], [], []
+        for term in terms:
+            term_pages, term_counts = self.term_page_ids(term)
+            page_ids.append(term_pages)
+            counts.append(term_counts)
+            term_labels.append(np.full(len(term_pages), term, dtype=object))
+        page_ids = np.concatenate(page_ids) if page_ids else np.array([], dtype=np.int64)
+        postings = self.pages().iloc[page_ids].reset_index(drop=True)
+        postings['page_id'] = page_ids
+        postings['term'] = np.concatenate(term_labels) if term_labels else np.array([], dtype=object)
+        postings['count'] = np.concatenate(counts) if counts else np.array([], dtype=np.int64)
+        return postings
+
+def build_term_index(df, token_column='token', count_column='count', text_column=None, max_ngram=1, column_names=None):
+    '''Build a TermIndex from the combined dataset. By default tokens and counts are read from the token level dataset. If `text_column` is given, the dataframe is treated as one row per page of joined text and n-grams up to `max_ngram` are indexed. `column_names` maps the page columns (magazine_title, datetime, htid, sequence) to the columns of df.'''
+    column_names = dict(DEFAULT_COLUMN_NAMES, **(column_names or {}))
+    page_keys = [column_names[col] for col in PAGE_COLUMNS]
+    grouped_pages = df.groupby(page_keys, sort=True, dropna=False, observed=True)
+    page_ids = grouped_pages.ngroup().values
+    pages = grouped_pages.size().reset_index()[page_keys]
+
+    if text_column is None:
+        tokens = pd.DataFrame({'term': df[token_column].astype(str).values, 'page': page_ids, 'count': df[count_column].fillna(0).values})
+    else:
+        ngrams = df[text_column].apply(get_ngrams, max_ngram=max_ngram)
+        tokens = pd.DataFrame({'term': ngrams.values, 'page': page_ids}).explode('term').dropna(subset=['term'])
+        tokens['count'] = 1
+    if text_column is None:
+        page_totals = np.bincount(page_ids, weights=tokens['count'].values, minlength=len(pages))
+    else:
+        page_totals = np.bincount(page_ids, weights=df[text_column].apply(lambda x: len(str(x).split())).values, minlength=len(pages))
+
+    term_codes, vocabulary = pd.factorize(tokens.term, sort=True)
+    postings = pd.DataFrame({'term': term_codes, 'page': tokens.page.values, 'count': tokens['count'].values})
+    postings = postings.groupby(['term', 'page'], sort=True)['count'].sum().reset_index()
+
+    magazine_codes, magazines = pd.factorize(pages[column_names['magazine_title']].astype(str))
+    htid_codes, htids = pd.factorize(pages[column_names['htid']].astype(str))
+    arrays = {
+        'offsets': np.searchsorted(postings.term.values, np.arange(len(vocabulary) + 1)).astype(np.int64),
+        'posting_pages': postings.page.values.astype(np.int32),
+        'posting_counts': postings['count'].values.astype(np.int32),
+        'page_magazines': magazine_codes.astype(np.int16),
+        'page_datetimes': pd.to_datetime(pages[column_names['datetime']]).values.astype('datetime64[ns]').astype(np.int64),
+        'page_htids': htid_codes.astype(np.int32),
+        'page_sequences': pages[column_names['sequence']].fillna(0).values.astype(np.int32),
+        'page_totals': page_totals.astype(np.int64),
+    }
+    return TermIndex(list(vocabulary), list(magazines), list(htids), arrays)
+
+def get_term_index(index_path, df=None, **kwargs):
+    '''Load the term index from index_path, building it from df and saving it first if it does not exist or was built from a different df, options or code. Without df an existing index is loaded as it is.'''
+    if df is None:
+        return TermIndex.load(index_path)
+    fingerprint = combine_fingerprints(CODE_VERSION, frame_fingerprint(df), json.dumps(kwargs, sort_keys=True, default=str))
+    if not (os.path.exists(os.path.join(index_path, 'metadata.json')) and is_up_to_date(index_path, fingerprint)):
+        build_term_index(df, **kwargs).save(index_path)
+        record_fingerprint(index_path, fingerprint)
+    return TermIndex.load(index_path)
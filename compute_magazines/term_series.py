@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+GROUP_COLUMNS = ['magazine_title', 'datetime']
+PAGE_COLUMN_NAMES = {'cleaned_magazine_title': 'magazine_title'}
+
+class TermSeries:
+    '''Per issue counts of batches of terms from the page by term matrix of a DocumentStore. Extracted features only have token counts, not word order, so terms are single tokens.'''
+
+    def __init__(self, store):
+        self.store = store
+        self.term_ids = pd.Index(store.vocabulary)
+        self.pages = store.pages.rename(columns=PAGE_COLUMN_NAMES)
+        self.pages['datetime'] = pd.to_datetime(self.pages.datetime)
+        self.page_totals = np.asarray(store.counts.sum(axis=1)).ravel()
+        self._columns = None
+        self._groups = {}
+
+    def columns(self):
+        """Get the counts as a CSC matrix so that the pages of a term are a slice, converting them on first use"""
+        if self._columns is None:
+            self._columns = self.store.counts.tocsc()
+        return self._columns
+
+    def groups(self, group_columns=GROUP_COLUMNS):
+        '''Get the groups (issues by default) with their number of pages and total words, the group of every page, and a sparse group by page indicator matrix. Cached per set of group columns.'''
+        key = tuple(group_columns)
+        if key not in self._groups:
+            grouped = self.pages.groupby(list(group_columns), sort=True, observed=True)
+            group_ids = grouped.ngroup().values
+            groups = grouped.size().reset_index(name='pages')
+            groups['original_counts'] = np.bincount(group_ids, weights=self.page_totals, minlength=len(groups)).astype(np.int64)
+            indicator = sparse.csr_matrix((np.ones(len(group_ids)), (group_ids, np.arange(len(group_ids)))), shape=(len(groups), len(group_ids)))
+            self._groups[key] = (groups, group_ids, indicator)
+        return self._groups[key]
+
+    def term_pages(self, terms, variants=None):
+        '''Get the page by term counts of a batch of terms, summing the columns of each term's variants (see fuzzy_terms.expand_terms). Unknown terms get empty columns. Multi word terms raise a ValueError and multi word variants are skipped, since the counts have no word order.'''
+        multi_word_terms = [term for term in terms if len(str(term).split()) > 1]
+        if len(multi_word_terms) > 0:
+            raise ValueError(f'Term series only count single tokens, not {multi_word_terms}')
+        positions, counted_terms = [], []
+        for position, term in enumerate(terms):
+            counted = [variant for variant in (variants or {}).get(term, [term]) if len(str(variant).split()) == 1]
+            positions.extend([position] * len(counted))
+            counted_terms.extend(counted)
+        columns = self.term_ids.get_indexer(pd.Series(counted_terms, dtype=object))
+        known = columns >= 0
+        selected = self.columns()[:, columns[known]]
+        # Add each known column to the column of its term, leaving unknown terms empty
+        placement = sparse.csr_matrix((np.ones(known.sum()), (np.arange(known.sum()), np.asarray(positions, dtype=np.int64)[known])), shape=(known.sum(), len(terms)))
+        return (selected @ placement).tocsc()
+
+    def term_matrix(self, terms, normalize=False, group_columns=GROUP_COLUMNS, variants=None):
+        '''Get a dense issue (or group) by term matrix of counts for a batch of terms in one sparse product. With `normalize` counts are divided by the total words of each issue.'''
+        groups, _, indicator = self.groups(group_columns)
+        matrix = np.asarray((indicator @ self.term_pages(terms, variants)).todense())
+        if normalize:
+            totals = groups.original_counts.values.astype(np.float64)
+            matrix = np.divide(matrix, totals[:, None], out=np.zeros_like(matrix, dtype=np.float64), where=totals[:, None] > 0)
+        return pd.DataFrame(matrix, index=pd.MultiIndex.from_frame(groups[list(group_columns)]), columns=list(terms))
+
+    def term_counts(self, terms, group_columns=GROUP_COLUMNS, counts_column='original_counts', variants=None):
+        '''Get the counts of a batch of terms in every issue (or group) in the long format of compare_pub_counts, so they can be passed to create_line_graph_term_frequencies and create_regression_graph_term_frequencies. term_frequency is term_counts divided by the issue's total words.'''
+        groups, group_ids, indicator = self.groups(group_columns)
+        counts = self.term_pages(terms, variants)
+        term_counts = np.asarray((indicator @ counts).todense())
+        # Words on the pages containing each term
+        present = counts.copy()
+        present.data = np.ones_like(present.data)
+        page_counts = np.asarray((indicator @ sparse.diags(self.page_totals.astype(np.float64)) @ present).todense())
+
+        long_df = groups[list(group_columns)].merge(pd.DataFrame({'term': list(terms)}), how='cross')
+        long_df[counts_column] = np.repeat(groups.original_counts.values, len(terms))
+        long_df['term_counts'] = term_counts.ravel()
+        long_df['page_counts'] = page_counts.ravel()
+        long_df['term_frequency'] = np.divide(long_df.term_counts.values, long_df[counts_column].values, out=np.zeros(len(long_df)), where=long_df[counts_column].values > 0)
+
+        # Sequences of the pages containing each term, as lists per issue and term
+        nonzero = counts.tocoo()
+        page_numbers = pd.DataFrame({'group': group_ids[nonzero.row], 'term_id': nonzero.col, 'page_number': self.pages.sequence.values[nonzero.row]})
+        page_numbers = page_numbers.sort_values(by=['group', 'term_id', 'page_number']).groupby(['group', 'term_id'])['page_number'].apply(list)
+        positions = page_numbers.index.get_level_values('group') * len(terms) + page_numbers.index.get_level_values('term_id')
+        page_number = [[] for _ in range(len(long_df))]
+        for position, sequences in zip(positions, page_numbers.values):
+            page_number[position] = sequences
+        long_df['page_number'] = page_number
+        return long_df[list(group_columns) + [counts_column, 'term_counts', 'page_number', 'page_counts', 'term', 'term_frequency']]
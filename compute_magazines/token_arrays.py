@@ -0,0 +1,169 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+# Token tables as parallel integer arrays. Tokens, POS tags and sections are interned to ids in global
+# vocabularies, and every volume's rows are appended to flat (page, token_id, pos_id, count, section)
+# arrays, so a string is stored once however often it occurs. The arrays are raw binary files that are
+# memory-mapped on load; pickling a TokenArrays only sends its path, so worker processes map the same
+# files instead of receiving a copy.
+
+ARRAY_DTYPES = {'page': np.int32, 'token_id': np.int32, 'pos_id': np.int16, 'count': np.int32, 'section': np.int8}
+VOCABULARIES = {'token_id': 'tokens', 'pos_id': 'pos', 'section': 'sections'}
+DEFAULT_COLUMN_NAMES = {'page': 'sequence', 'token_id': 'token', 'pos_id': 'pos', 'count': 'count', 'section': 'section'}
+
+class Vocabulary:
+    '''Interns strings to consecutive integer ids. Ids never change once assigned, so arrays built at different times with the same vocabulary stay compatible.'''
+
+    def __init__(self, terms=None):
+        self.terms = list(terms or [])
+        self.index = pd.Index(self.terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def intern(self, values):
+        """Get the ids of an array of strings, adding any new strings to the vocabulary"""
+        values = pd.Series(values, dtype=object).fillna('').astype(str)
+        ids = self.index.get_indexer(values)
+        if (ids < 0).any():
+            new_terms = pd.unique(values[ids < 0])
+            self.terms.extend(new_terms)
+            self.index = pd.Index(self.terms)
+            ids = self.index.get_indexer(values)
+        return ids
+
+    def lookup(self, values):
+        """Get the ids of strings without adding them (-1 for unknown strings)"""
+        return self.index.get_indexer(pd.Series(values, dtype=object).astype(str))
+
+    def decode(self, ids):
+        """Turn ids back into strings as a categorical, so each string is still only stored once"""
+        return pd.Categorical.from_codes(np.asarray(ids), categories=self.terms)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.terms, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+def array_path(path, name):
+    return os.path.join(path, name + '.bin')
+
+def open_array(path, name):
+    """Memory-map one of the arrays (an empty file cannot be mapped, so it becomes an empty array)"""
+    file_name = array_path(path, name)
+    if os.path.getsize(file_name) == 0:
+        return np.zeros(0, dtype=ARRAY_DTYPES[name])
+    return np.memmap(file_name, dtype=ARRAY_DTYPES[name], mode='r')
+
+class TokenArrays:
+    '''Memory-mapped token arrays of every volume with their vocabularies. Rows of volume i are offsets[i] to offsets[i + 1], sorted by page.'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'metadata.json')) as f:
+            metadata = json.load(f)
+        self.htids = metadata['htids']
+        self.magazines = metadata['magazines']
+        self.volume_ids = {htid: i for i, htid in enumerate(self.htids)}
+        self.offsets = np.asarray(metadata['offsets'], dtype=np.int64)
+        self.vocabularies = {name: Vocabulary.load(os.path.join(path, name + '.json')) for name in VOCABULARIES.values()}
+        for name in ARRAY_DTYPES:
+            setattr(self, name, open_array(path, name))
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def tokens(self):
+        return self.vocabularies['tokens']
+
+    def volume_slice(self, htid):
+        i = self.volume_ids[htid]
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def volume(self, htid):
+        """Get the arrays of a single volume as views into the memory-mapped files"""
+        rows = self.volume_slice(htid)
+        return {name: getattr(self, name)[rows] for name in ARRAY_DTYPES}
+
+    def volume_codes(self):
+        """Get the volume id of every row"""
+        return np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.offsets))
+
+    def to_df(self, htids=None, decode=True):
+        '''Get the token table of some volumes (all by default) as a dataframe. With `decode` the tokens, POS tags, sections, htids and magazines are categoricals, otherwise the integer ids are returned.'''
+        htids = self.htids if htids is None else htids
+        volume_ids = np.array([self.volume_ids[htid] for htid in htids], dtype=np.int64)
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in volume_ids]) if len(volume_ids) else np.zeros(0, dtype=np.int64)
+        volume_codes = np.repeat(volume_ids, self.offsets[volume_ids + 1] - self.offsets[volume_ids])
+        df = pd.DataFrame({name: np.asarray(getattr(self, name)[rows]) for name in ARRAY_DTYPES})
+        if not decode:
+            df.insert(0, 'volume_id', volume_codes)
+            return df
+        df.insert(0, 'htid', pd.Categorical.from_codes(volume_codes, categories=self.htids))
+        magazine_codes, magazines = pd.factorize(pd.Series(self.magazines))
+        df.insert(0, 'magazine_title', pd.Categorical.from_codes(magazine_codes[volume_codes], categories=magazines))
+        for column, name in VOCABULARIES.items():
+            df[column] = self.vocabularies[name].decode(df[column].values)
+        return df.rename(columns={'page': 'sequence', 'token_id': 'token', 'pos_id': 'pos'})
+
+    def token_totals(self):
+        """Get the total count of every token in the corpus"""
+        totals = np.bincount(np.asarray(self.token_id), weights=np.asarray(self.count), minlength=len(self.tokens))
+        return pd.Series(totals.astype(np.int64), index=self.tokens.terms)
+
+    def term_rows(self, term):
+        """Get the rows where a token occurs"""
+        token_id = self.tokens.lookup([term])[0]
+        return np.flatnonzero(np.asarray(self.token_id) == token_id) if token_id >= 0 else np.zeros(0, dtype=np.int64)
+
+def build_token_arrays(path, volume_dfs, column_names=None, vocabularies=None):
+    '''Build TokenArrays in `path` from an iterable of volume token tables (one dataframe per volume, with an htid and magazine_title column). Each volume is interned and appended to the array files, so only one volume is in memory at a time. Existing vocabularies can be passed to keep ids compatible with another store.'''
+    column_names = dict(DEFAULT_COLUMN_NAMES, **(column_names or {}))
+    vocabularies = vocabularies or {name: Vocabulary() for name in VOCABULARIES.values()}
+    partial_path = path.rstrip('/') + '.partial'
+    if os.path.exists(partial_path):
+        shutil.rmtree(partial_path)
+    os.makedirs(partial_path)
+    files = {name: open(array_path(partial_path, name), 'wb') for name in ARRAY_DTYPES}
+    htids, magazines, offsets = [], [], [0]
+    try:
+        for df in volume_dfs:
+            if len(df) == 0:
+                continue
+            df = df.sort_values(by=column_names['page'], kind='stable')
+            columns = {
+                'page': df[column_names['page']].fillna(0).values,
+                'count': df[column_names['count']].fillna(0).values,
+            }
+            for column, name in VOCABULARIES.items():
+                columns[column] = vocabularies[name].intern(df[column_names[column]].values)
+            for name, dtype in ARRAY_DTYPES.items():
+                np.asarray(columns[name]).astype(dtype).tofile(files[name])
+            htids.append(str(df['htid'].iloc[0]))
+            magazines.append(str(df['magazine_title'].iloc[0]))
+            offsets.append(offsets[-1] + len(df))
+    finally:
+        for f in files.values():
+            f.close()
+    for name, vocabulary in vocabularies.items():
+        vocabulary.save(os.path.join(partial_path, name + '.json'))
+    with open(os.path.join(partial_path, 'metadata.json'), 'w') as f:
+        json.dump({'htids': htids, 'magazines': magazines, 'offsets': offsets}, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(partial_path, path)
+    return TokenArrays(path)
@@ -0,0 +1,103 @@
+import os
+from urllib.parse import quote
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Partitioned Parquet store for the merged per-volume token tables. Volumes are written to
+# <store_path>/magazine_title=<magazine>/htid=<htid>/part-0.parquet so that a single magazine
+# or volume can be read without touching the rest of the corpus.
+
+PARTITION_COLUMNS = ['magazine_title', 'htid']
+DICTIONARY_COLUMNS = ['token', 'pos', 'type_of_page', 'section']
+INTEGER_COLUMNS = ['sequence', 'count']
+DATETIME_COLUMNS = ['start_issue', 'end_issue']
+PART_FILE = 'part-0.parquet'
+PARTITION_SCHEMA = pa.schema([pa.field(col, pa.string()) for col in PARTITION_COLUMNS])
+
+def volume_partition_path(store_path, magazine_title, htid):
+    '''Get the partition directory for a volume. Values are uri encoded since htids can contain characters like `:` and `/`.'''
+    return os.path.join(store_path, f'magazine_title={quote(str(magazine_title), safe="")}', f'htid={quote(str(htid), safe="")}')
+
+def volume_to_table(df):
+    """Convert a merged volume dataframe to an Arrow table with typed and dictionary encoded columns"""
+    df = df.drop(columns=[col for col in PARTITION_COLUMNS if col in df.columns])
+    fields = []
+    for col in df.columns:
+        if col in DICTIONARY_COLUMNS:
+            df[col] = df[col].fillna('').astype(str)
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+        elif col in INTEGER_COLUMNS:
+            df[col] = df[col].fillna(0).astype('int32')
+            fields.append(pa.field(col, pa.int32()))
+        elif col in DATETIME_COLUMNS:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+            fields.append(pa.field(col, pa.timestamp('ms')))
+        elif df[col].dtype == object:
+            df[col] = df[col].astype(str).where(df[col].notna(), None)
+            fields.append(pa.field(col, pa.string()))
+        else:
+            fields.append(pa.field(col, pa.from_numpy_dtype(df[col].dtype)))
+    return pa.Table.from_pandas(df, schema=pa.schema(fields), preserve_index=False)
+
+def write_volume(df, store_path):
+    """Write a merged volume into its magazine/htid partition and return the path of the written file"""
+    partition_path = volume_partition_path(store_path, df['magazine_title'].iloc[0], df['htid'].iloc[0])
+    if not os.path.exists(partition_path):
+        os.makedirs(partition_path)
+    file_name = os.path.join(partition_path, PART_FILE)
+    # Hidden files are ignored by dataset discovery, so a half-written volume is never read
+    partial_name = os.path.join(partition_path, '.' + PART_FILE + '.partial')
+    pq.write_table(volume_to_table(df), partial_name, compression='zstd')
+    os.replace(partial_name, file_name)
+    return file_name
+
+def unify_type(types):
+    """Get the type of a column from its types in every volume: null columns take the other type, mixed numbers become float64 and anything else that differs becomes a string"""
+    types = [data_type for data_type in dict.fromkeys(types) if not pa.types.is_null(data_type)]
+    if len(types) == 0:
+        return pa.null()
+    if len(types) == 1:
+        return types[0]
+    if all(pa.types.is_integer(data_type) or pa.types.is_floating(data_type) or pa.types.is_boolean(data_type) for data_type in types):
+        return pa.float64()
+    return pa.string()
+
+def unify_schemas(schemas):
+    """Union the columns of several schemas, in the order they first appear"""
+    types = {}
+    for schema in schemas:
+        for field in schema:
+            types.setdefault(field.name, []).append(field.type)
+    return pa.schema([pa.field(name, unify_type(field_types)) for name, field_types in types.items()])
+
+def get_dataset(store_path, partition_filter=None):
+    '''Open the store as a hive partitioned Arrow dataset. Volumes can have different columns, and Arrow would otherwise take the schema of the first file only, so the dataset schema is the union of the schemas of the volumes matching `partition_filter` (all volumes by default). Other volumes are not opened.'''
+    # Discover the files with only the partition columns so that no file is opened until it is selected
+    partitioning = ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+    dataset = ds.dataset(store_path, format='parquet', partitioning=partitioning, schema=PARTITION_SCHEMA)
+    schemas = [fragment.physical_schema for fragment in dataset.get_fragments(filter=partition_filter)] + [PARTITION_SCHEMA]
+    return ds.dataset(store_path, format='parquet', partitioning=partitioning, schema=unify_schemas(schemas))
+
+def build_filter(magazines=None, htids=None, start_date=None, end_date=None):
+    """Build a filter expression on the partition columns and issue dates that is pushed down to the Parquet reader"""
+    expression = None
+    conditions = []
+    if magazines is not None:
+        conditions.append(ds.field('magazine_title').isin(list(magazines)))
+    if htids is not None:
+        conditions.append(ds.field('htid').isin(list(htids)))
+    if start_date is not None:
+        conditions.append(ds.field('start_issue') >= pa.scalar(pd.Timestamp(start_date).to_pydatetime(), type=pa.timestamp('ms')))
+    if end_date is not None:
+        conditions.append(ds.field('start_issue') <= pa.scalar(pd.Timestamp(end_date).to_pydatetime(), type=pa.timestamp('ms')))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def read_volumes(store_path, columns=None, magazines=None, htids=None, start_date=None, end_date=None):
+    '''Read volumes from the store into a dataframe. Only the requested `columns` are read and only the partitions and row groups matching the magazines, htids and issue date range are scanned. Dictionary columns come back as categoricals.'''
+    dataset = get_dataset(store_path, build_filter(magazines, htids))
+    table = dataset.to_table(columns=columns, filter=build_filter(magazines, htids, start_date, end_date))
+    return table.to_pandas()
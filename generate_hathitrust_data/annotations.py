@@ -0,0 +1,50 @@
+import pandas as pd
+from functools import lru_cache
+from datetime import datetime
+
+# Vectorized normalization of the annotation datasets created manually in Notion. Every function
+# works on all issues at once with groupby transforms instead of slicing one issue at a time.
+
+@lru_cache(maxsize=None)
+def parse_annotated_date(dates):
+    '''Parse a "Month Day Year", "Month Year" or "Month-Month Year" annotation date into the start and end of the issue. Results are cached since an annotation file only has one distinct date per issue.'''
+    date = dates.replace('-', ' ').split(' ')
+    day = date[1] if (len(date) == 3) and ('-' not in dates) else '1'
+    start_month = date[0]
+    end_month = date[1] if (len(date) > 2) and ('-' in dates) else start_month
+    year = date[-1]
+    start_issue = datetime.strptime(day + ' ' + start_month + ' ' + year, '%d %B %Y')
+    end_issue = datetime.strptime(day + ' ' + end_month + ' ' + year, '%d %B %Y')
+    return start_issue, end_issue
+
+def add_issue_dates(df, date_column='dates'):
+    """Add start_issue and end_issue columns, parsing each distinct date string only once"""
+    codes, uniques = pd.factorize(df[date_column])
+    parsed = [parse_annotated_date(str(date)) for date in uniques]
+    start_issues = pd.Series([start for start, _ in parsed] + [pd.NaT], dtype='datetime64[ns]')
+    end_issues = pd.Series([end for _, end in parsed] + [pd.NaT], dtype='datetime64[ns]')
+    # Missing dates are coded as -1, which picks the trailing NaT
+    df['start_issue'] = start_issues.values[codes]
+    df['end_issue'] = end_issues.values[codes]
+    return df
+
+def first_page_of_type(df, group_column, page_type, how='first'):
+    """Broadcast the first (or last) sequence of a given type of page to every row of its group"""
+    return df.sequence.where(df.type_of_page == page_type).groupby(df[group_column]).transform(how)
+
+def duplicate_range_mask(df, group_column):
+    '''Mark the pages inside the duplicate range of each group. The range comes from the notes of the first `duplicates` row in the group, written as "start-end".'''
+    notes = df.notes.where(df.type_of_page == 'duplicates').groupby(df[group_column]).transform('first')
+    pages = notes.astype(str).str.extract(r'^\s*(\d+)\s*-\s*(\d+)').astype(float)
+    return df.sequence.between(pages[0], pages[1]).fillna(False).astype(bool)
+
+def remove_duplicate_ranges(df, group_column):
+    """Drop the pages marked as duplicates in every group"""
+    return df[~duplicate_range_mask(df, group_column)]
+
+def trim_issues(df, group_column):
+    '''Trim every group to the pages between its cover (or table of contents if there is no cover) and its last end_of_issue page, then drop its duplicate range. Groups without one of these annotations are not trimmed on that side.'''
+    last_page = first_page_of_type(df, group_column, 'end_of_issue', how='last')
+    first_page = first_page_of_type(df, group_column, 'cover_page').fillna(first_page_of_type(df, group_column, 'toc'))
+    keep = (last_page.isna() | (df.sequence <= last_page)) & (first_page.isna() | (df.sequence >= first_page))
+    return df[keep & ~duplicate_range_mask(df, group_column)]
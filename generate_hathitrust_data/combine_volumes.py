@@ -1,11 +1,12 @@
+import os
+import sys
 import pandas as pd 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from generate_hathitrust_data.annotations import remove_duplicate_ranges
 
-def remove_duplicates(rows):
-    final_rows = rows.copy()
-    if any(rows.type_of_page == 'duplicates'):
-        pages = rows[rows.type_of_page == 'duplicates'].notes.values[0]
-        final_rows = rows[~rows.sequence.between(int(pages.split('-')[0]), int(pages.split('-')[1]))]
-    return final_rows
+def remove_duplicates(df, group_column='original_volumes'):
+    """Remove the duplicate page range annotated in the notes of each volume"""
+    return remove_duplicate_ranges(df, group_column)
 
 
 def combine_volumes():
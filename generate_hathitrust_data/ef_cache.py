@@ -0,0 +1,136 @@
+import os
+import io
+import time
+import hashlib
+import sqlite3
+import sys
+import argparse
+from contextlib import contextmanager
+import pandas as pd
+from htrc_features import FeatureReader
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from compute_magazines.instrumentation import instrumentation, stage, configure_logging
+
+# Local, content addressed cache of Extracted Features token lists. Each volume's
+# vol.tokenlist(section='all') is stored once as objects/<sha256>.parquet and an sqlite index maps
+# htids to their object, title, size and last access time so the cache can be capped with LRU eviction.
+# The cache only holds paths, so it can be passed to worker processes.
+
+class EFCacheMiss(Exception):
+    """Raised in offline mode when a volume is not in the cache"""
+    pass
+
+class EFCache:
+    '''Cache of Extracted Features token lists keyed by htid and content hash. With `offline` volumes are only read from the cache and a miss raises EFCacheMiss instead of downloading. `max_bytes` caps the size of the cache, evicting the least recently used volumes.'''
+
+    def __init__(self, cache_dir, max_bytes=None, offline=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        if not os.path.exists(self.objects_dir):
+            os.makedirs(self.objects_dir)
+        with self.connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS volumes (htid TEXT PRIMARY KEY, hash TEXT, title TEXT, size INTEGER, last_access REAL)')
+
+    @contextmanager
+    def connect(self):
+        """Open the index, committing (or rolling back) on exit and always closing the connection"""
+        connection = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite'), timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def object_path(self, content_hash):
+        return os.path.join(self.objects_dir, content_hash + '.parquet')
+
+    def __contains__(self, htid):
+        return self.content_hash(htid) is not None
+
+    def content_hash(self, htid):
+        """Get the content hash of a cached volume, or None if it is not cached"""
+        with self.connect() as connection:
+            row = connection.execute('SELECT hash FROM volumes WHERE htid = ?', (htid,)).fetchone()
+        return row[0] if (row is not None) and os.path.exists(self.object_path(row[0])) else None
+
+    def get(self, htid):
+        """Get the title and token list of a volume, downloading and caching it on a miss unless the cache is offline"""
+        with self.connect() as connection:
+            row = connection.execute('SELECT hash, title FROM volumes WHERE htid = ?', (htid,)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE volumes SET last_access = ? WHERE htid = ?', (time.time(), htid))
+        # Read the object after the index is committed and closed, so a large volume does not hold the index lock
+        if row is not None:
+            try:
+                return row[1], pd.read_parquet(self.object_path(row[0]))
+            except FileNotFoundError:
+                pass
+        if self.offline:
+            raise EFCacheMiss(f'{htid} is not in the cache at {self.cache_dir}')
+        vol = FeatureReader(ids=[htid]).first()
+        volume_df = vol.tokenlist(section='all').reset_index()
+        self.put(htid, vol.title, volume_df)
+        return vol.title, volume_df
+
+    def put(self, htid, title, volume_df):
+        """Store a volume's token list under the hash of its content"""
+        buffer = io.BytesIO()
+        volume_df.to_parquet(buffer, index=False)
+        content = buffer.getvalue()
+        content_hash = hashlib.sha256(content).hexdigest()
+        object_path = self.object_path(content_hash)
+        if not os.path.exists(object_path):
+            partial_path = object_path + '.partial'
+            with open(partial_path, 'wb') as f:
+                f.write(content)
+            os.replace(partial_path, object_path)
+        with self.connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO volumes VALUES (?, ?, ?, ?, ?)', (htid, content_hash, title, len(content), time.time()))
+        self.evict()
+        return content_hash
+
+    def evict(self):
+        '''Remove the least recently used volumes until the cache fits in max_bytes. Identical volumes share an object, so each object is counted once, and it is removed with all the volumes that point to it.'''
+        if self.max_bytes is None:
+            return
+        with self.connect() as connection:
+            rows = connection.execute('SELECT htid, hash, size FROM volumes ORDER BY last_access DESC').fetchall()
+            total = 0
+            kept, evicted = set(), set()
+            for htid, content_hash, size in rows:
+                if content_hash in kept:
+                    continue
+                if content_hash not in evicted:
+                    total += size
+                    if total <= self.max_bytes:
+                        kept.add(content_hash)
+                        continue
+                    evicted.add(content_hash)
+                connection.execute('DELETE FROM volumes WHERE htid = ?', (htid,))
+        for content_hash in evicted:
+            if os.path.exists(self.object_path(content_hash)):
+                os.remove(self.object_path(content_hash))
+
+def prefetch(metadata_file, cache):
+    """Warm the cache with every volume listed in a metadata file"""
+    md = pd.read_csv(metadata_file, encoding = "utf-8")
+    for htid in md['htid'].tolist():
+        with stage('fetch', htid, source='prefetch', cached=htid in cache) as event:
+            if not event['cached']:
+                event['rows'] = len(cache.get(htid)[1])
+
+if __name__ ==  "__main__" :
+    parser = argparse.ArgumentParser(description='Warm the Extracted Features cache for a metadata file')
+    parser.add_argument('metadata_file', nargs='+', help='metadata csv(s) with an htid column')
+    parser.add_argument('--cache-dir', default='../ef_cache', help='location of the cache')
+    parser.add_argument('--cache-size-gb', type=float, default=None, help='maximum size of the cache')
+    parser.add_argument('--log-file', default=None, help='write one JSON line per volume to this file instead of stderr')
+    args = parser.parse_args()
+    configure_logging(args.log_file)
+    max_bytes = int(args.cache_size_gb * 1024 ** 3) if args.cache_size_gb is not None else None
+    cache = EFCache(args.cache_dir, max_bytes=max_bytes)
+    for metadata_file in args.metadata_file:
+        prefetch(metadata_file, cache)
+    print(instrumentation.summary().to_string(index=False))
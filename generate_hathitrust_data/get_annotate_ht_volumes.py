@@ -1,41 +1,30 @@
 import pandas as pd 
 from htrc_features import FeatureReader
 import os
-from progress.bar import IncrementalBar
-from thefuzz import fuzz
-from datetime import datetime
-
-def transform_annotated_dates(rows):
-    """Transform metadata dates into mergeable dates"""
-    date = rows[0:1].dates.values[0].replace('-', ' ').split(' ')
-    day = date[1] if (len(date) == 3) and ('-' not in rows[0:1].dates.values[0]) else '1'
-    start_month = date[0] 
-    end_month = date[1] if (len(date) > 2) and ('-' in rows[0:1].dates.values[0]) else start_month
-    year = date[-1]
-
-    start_date = day +' ' + start_month + ' ' + year
-    end_date = day +' ' + end_month + ' ' + year
-    rows['start_issue'] = datetime.strptime(start_date, '%d %B %Y')
-    rows['end_issue'] = datetime.strptime(end_date, '%d %B %Y')
-    return rows
-
-def cut_vols(rows):
-    # Remove duplicates from issues and also make sure that sequence doesn't include first page for some reason I can't remember now...
-    ends = rows[rows.type_of_page == 'end_of_issue'].sequence.tolist()[-1]
-    rows = rows[rows.sequence <= ends]
-    final_rows = rows
-    # if any(rows.type_of_page == 'scanner_page') ==:
-    first_page = rows[rows.type_of_page == 'cover_page'].sequence.values.tolist()
-    if len(first_page) > 0:
-        first_page = first_page[0]
-    else:
-        first_page = rows[rows.type_of_page == 'toc'].sequence.values.tolist()[0]
-    final_rows = rows[rows.sequence > first_page -1]
-    if any(rows.type_of_page == 'duplicates'):
-        pages = rows[rows.type_of_page == 'duplicates'].notes.values[0]
-        final_rows = rows[~rows.sequence.between(int(pages.split('-')[0]), int(pages.split('-')[1]))]
-    return final_rows
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import compute_magazines.volume_store as volume_store
+from compute_magazines.volume_store import write_volume
+from compute_magazines.fingerprints import combine_fingerprints, frame_fingerprint, code_fingerprint
+from compute_magazines.directory_resolver import get_directory_mapping
+import generate_hathitrust_data.annotations as annotations
+from generate_hathitrust_data.annotations import add_issue_dates, trim_issues
+from generate_hathitrust_data.ef_cache import EFCache, EFCacheMiss
+from compute_magazines.instrumentation import Instrumentation, instrumentation, stage, profile_volume, configure_logging, enable_profiling
+
+MANIFEST_FILE = 'manifest.jsonl'
+PAGE_KEYS = ['original_volumes', 'sequence']
+TOKEN_COLUMNS = ['section', 'token', 'pos', 'count']
+# Any change to the code that merges and writes volumes invalidates them
+CODE_VERSION = code_fingerprint(os.path.abspath(__file__), annotations.__file__, volume_store.__file__)
 
+def cut_vols(df, group_column='date'):
+    """Trim each issue to its cover/toc and end_of_issue pages and remove its duplicate range"""
+    return trim_issues(df, group_column)
 
 def clean_annotated_df(annotated_df):
     """Clean and normalize dates in the annotated datasets that were created manually in Notion"""
@@ -43,71 +32,210 @@ def clean_annotated_df(annotated_df):
     annotated_df.notes = annotated_df['notes'].fillna('')
     annotated_df = annotated_df.fillna(method='ffill')
     
-    annotated_df = annotated_df.groupby('dates').apply(transform_annotated_dates)
+    annotated_df = add_issue_dates(annotated_df)
     return annotated_df
     
 
-def merge_datasets(annotated_df, df):
-    """Merge extracted features dataset with the annotated one"""
-    final_anno = df.merge(annotated_df, on=['original_volumes', 'sequence'], how='outer')
-    final_anno = final_anno.sort_values(by=['original_volumes', 'sequence'])
-    final_anno.type_of_page.fillna('content', inplace=True)
+def build_page_table(annotated_df, df, page_numbers=None):
+    '''Resolve the annotations for every page of the volume on a compact page table with one row per (page, annotation). Page level columns from the extracted features are kept once per page and each page gets an integer page_key that the tokens can be joined on. A page number table from compute_magazines.page_numbers adds the inferred printed page number of each page.'''
+    page_columns = [col for col in df.columns if col not in TOKEN_COLUMNS]
+    ef_pages = df[page_columns].drop_duplicates(subset=PAGE_KEYS)
+    pages = ef_pages.merge(annotated_df, on=PAGE_KEYS, how='outer')
+    pages = pages.sort_values(by=PAGE_KEYS).reset_index(drop=True)
+    pages.type_of_page.fillna('content', inplace=True)
+    pages.notes.fillna('', inplace=True)
+    pages.fillna(method='ffill', inplace=True)
+    pages.fillna(method='bfill', inplace=True)
+    if page_numbers is not None:
+        pages = pages.merge(page_numbers[['htid', 'sequence', 'inferred_page_number']], on=['htid', 'sequence'], how='left')
+    pages['page_key'] = pages.groupby(PAGE_KEYS, sort=False).ngroup()
+    return pages
+
+def build_token_table(pages, df):
+    """Attach the integer page_key to the tokens, adding an empty token for annotated pages that have no extracted features"""
+    unique_pages = pages.drop_duplicates(subset='page_key')
+    page_index = pd.MultiIndex.from_frame(unique_pages[PAGE_KEYS])
+    tokens = df[[col for col in df.columns if col in TOKEN_COLUMNS]].copy()
+    tokens['page_key'] = unique_pages.page_key.values[page_index.get_indexer(pd.MultiIndex.from_frame(df[PAGE_KEYS]))]
+    empty_pages = unique_pages.loc[~unique_pages.page_key.isin(tokens.page_key), ['page_key']]
+    if len(empty_pages) > 0:
+        tokens = pd.concat([tokens, empty_pages])
+    tokens = tokens.sort_values(by='page_key', kind='stable').reset_index(drop=True)
+    tokens.update(tokens[[col for col in ['token', 'section', 'pos'] if col in tokens.columns]].fillna(''))
+    tokens.update(tokens[['count']].fillna(0))
+    return tokens
 
-    final_anno.update(final_anno[['token','notes', 'section', 'pos']].fillna(''))
-    final_anno.update(final_anno[['count']].fillna(0))
-    final_anno.fillna(method='ffill', inplace=True)
-    final_anno.fillna(method='bfill', inplace=True)
+def merge_datasets(annotated_df, df, flatten=True, page_numbers=None):
+    '''Merge extracted features dataset with the annotated one. Annotations are resolved on a page table and joined to the tokens through an integer page key. With `flatten` one row per token is returned, the same as an outer merge on (original_volumes, sequence) with the gaps filled forwards and backwards. Otherwise the token table and page table are returned separately so page metadata is only stored once per page. `page_numbers` (see build_page_table) adds an inferred_page_number column.'''
+    pages = build_page_table(annotated_df, df, page_numbers)
+    tokens = build_token_table(pages, df)
+    if not flatten:
+        return tokens, pages
+    final_anno = tokens.merge(pages, on='page_key', how='left')
+    columns = [col for col in df.columns if col in final_anno.columns]
+    final_anno = final_anno[columns + [col for col in final_anno.columns if (col not in columns) and (col != 'page_key')]]
     # final_anno['implied_zero'] = final_anno['page_number'] - final_anno['number'] 
     
     # final_anno = final_anno.drop(columns=['index'])
     # final_anno = final_anno.drop_duplicates(subset=['date_vols', 'page_number'], keep='last')
-    final_anno.reset_index(drop=True)
-    # final_anno = final_anno.groupby('date', as_index=False).apply(cut_vols).reset_index()
+    # final_anno = cut_vols(final_anno, 'date')
     # final_anno = final_anno.loc[:, ~final_anno.columns.str.contains('^level')]
     return final_anno
 
-def read_ids(md, folder, annotated_df):
-    '''This function reads in the list of ids scraped from Hathi Trust and the folder destination. It gets the volume and tokenlist from Hathi Trust, and then calls spread table which separates out by page all tokens.'''
-    directory = os.path.dirname(folder)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    volids = md['htid'].tolist()
-    fr = FeatureReader(ids=volids)
-
-    for vol in fr:
-        row = md.loc[md['htid'] == vol.id].copy()
-        # print(row, vol.title)
-        title = vol.title if ':' not in vol.title else vol.title.split(':')[0]
-        
-        title = title.lower().replace('.', '').split(' ')
-        magazine_title = "_".join(title)
-        title = "_".join(title)+'_'+ '_'.join(str(row.date.values[0]).split(' '))
-        title = title.replace(',', '_')
-        title = title.replace('__', '_')
-        file_name = folder+ '/' + title + '.csv'
-        date_vols = row.date.values[0]
-        subset_annotated_df = annotated_df.loc[annotated_df.original_volumes == date_vols]
-        
-        if not os.path.exists(file_name):
-            # print(f'processing {file_name}')
-            volume_df = vol.tokenlist(section='all')
-            volume_df = volume_df.reset_index()
-            file_name = file_name
-            volume_df['magazine_title'] = magazine_title
-            volume_df['title'] = title
-            volume_df['htid'] = row.htid.values[0]
-            volume_df['link'] = row.link.values[0]
-            volume_df['original_volumes'] = date_vols
-            volume_df = volume_df.rename(columns={'lowercase': 'token', 'page': 'sequence'})
-            subset_annotated_df = subset_annotated_df.rename(columns={'page_number': 'sequence'})
-            merged_df = merge_datasets(subset_annotated_df, volume_df)
-            merged_df.to_csv(file_name, index=False)
-        #     # spread_table(title, file_name) #Run this line if you want to group characters on pages into single rows
-        # elif os.path.exists(file_name.split('.csv')[0] + '_grouped.csv'):
-        #     add_volumes_dates(title, file_name, magazine_title, date_vols)
-        # else:
-        #     print(f'{file_name} already exists')
+def volume_file_name(vol_title, row, folder):
+    """Build the magazine title, volume title and output file name for a volume"""
+    title = vol_title if ':' not in vol_title else vol_title.split(':')[0]
+
+    title = title.lower().replace('.', '').split(' ')
+    magazine_title = "_".join(title)
+    title = "_".join(title)+'_'+ '_'.join(str(row['date']).split(' '))
+    title = title.replace(',', '_')
+    title = title.replace('__', '_')
+    file_name = folder+ '/' + title + '.csv'
+    return magazine_title, title, file_name
+
+def load_manifest(manifest_path):
+    """Read the per-volume manifest and return the latest record for each htid"""
+    records = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    # A crash can leave a truncated last line, which we treat as not processed
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    records[record['htid']] = record
+    return records
+
+def append_manifest(manifest_path, record):
+    """Append a single volume record to the manifest"""
+    with open(manifest_path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def record_volume(manifest_path, record, records):
+    """Append a finished volume to the manifest, the run's instrumentation and its records"""
+    append_manifest(manifest_path, record)
+    instrumentation.extend(record['stages'])
+    records.append(record)
+
+def is_volume_done(record, fingerprint):
+    """A volume is finished only if the manifest says so, its output file is still on disk and it was built from the same inputs"""
+    return (record is not None) and (record['status'] == 'done') and os.path.exists(record['file_name']) and (record.get('fingerprint') == fingerprint)
+
+def volume_fingerprint(input_fingerprint, ef_fingerprint):
+    """Fingerprint a volume from its annotation, metadata and output settings (input_fingerprint) and its extracted features"""
+    return combine_fingerprints(input_fingerprint, ef_fingerprint, CODE_VERSION)
+
+def get_ef_fingerprint(htid, ef_cache=None):
+    '''Fingerprint the extracted features of a volume. Cached volumes use their content hash, uncached volumes get None so they are always processed, and without a cache the remote features are assumed not to change.'''
+    if ef_cache is not None:
+        return ef_cache.content_hash(htid)
+    return 'remote'
+
+def get_volume(htid, ef_cache=None, events=None):
+    """Get the title and token list of a volume from the Extracted Features cache if there is one, otherwise from Hathi Trust"""
+    events = events if events is not None else Instrumentation(log=False)
+    if ef_cache is not None:
+        with events.stage('fetch', htid, source='cache') as event:
+            vol_title, volume_df = ef_cache.get(htid)
+            event['rows'] = len(volume_df)
+        return vol_title, volume_df
+    with events.stage('fetch', htid, source='remote'):
+        vol = FeatureReader(ids=[htid]).first()
+    with events.stage('tokenlist', htid) as event:
+        volume_df = vol.tokenlist(section='all').reset_index()
+        event['rows'] = len(volume_df)
+    return vol.title, volume_df
+
+def process_volume(htid, row, subset_annotated_df, folder, store_path=None, ef_cache=None, input_fingerprint=''):
+    """Extract, merge and write a single volume, either as a csv in `folder` or into the Parquet store at `store_path`. Returns a manifest record with the timings of each stage rather than raising so that one bad volume does not stop a run, except for misses in an offline cache, which stop the run."""
+    start = time.time()
+    record = {'htid': htid, 'file_name': None, 'status': 'error', 'rows': 0, 'duration': 0.0, 'error': ''}
+    events = Instrumentation(log=False)
+    try:
+        with profile_volume(htid):
+            vol_title, volume_df = get_volume(htid, ef_cache, events)
+            record['fingerprint'] = volume_fingerprint(input_fingerprint, get_ef_fingerprint(htid, ef_cache))
+            magazine_title, title, file_name = volume_file_name(vol_title, row, folder)
+            record['file_name'] = file_name
+            date_vols = row['date']
+
+            with events.stage('merge', htid) as event:
+                volume_df['magazine_title'] = magazine_title
+                volume_df['title'] = title
+                volume_df['htid'] = row['htid']
+                volume_df['link'] = row['link']
+                volume_df['original_volumes'] = date_vols
+                volume_df = volume_df.rename(columns={'lowercase': 'token', 'page': 'sequence'})
+                subset_annotated_df = subset_annotated_df.rename(columns={'page_number': 'sequence'})
+                merged_df = merge_datasets(subset_annotated_df, volume_df)
+                event['rows'] = len(merged_df)
+            with events.stage('write', htid) as event:
+                if store_path is not None:
+                    record['file_name'] = write_volume(merged_df, store_path)
+                else:
+                    # Write to a temporary file and rename so a finished file is never confused with a half-written one
+                    partial_name = file_name[:-len('.csv')] + '.partial'
+                    merged_df.to_csv(partial_name, index=False)
+                    os.replace(partial_name, file_name)
+                event['rows'] = len(merged_df)
+                event['bytes_written'] = os.path.getsize(record['file_name'])
+            record['rows'] = len(merged_df)
+            record['status'] = 'done'
+    except EFCacheMiss:
+        raise
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+    record['duration'] = round(time.time() - start, 3)
+    record['stages'] = events.events
+    return record
+
+def read_ids(md, folder, annotated_df, workers=1, store_path=None, ef_cache=None):
+    '''This function reads in the list of ids scraped from Hathi Trust and the folder destination. It gets the volume and tokenlist from Hathi Trust, merges it with the annotations and writes one file per volume (or one partition per volume if a Parquet `store_path` is given). Volumes are processed in a pool of `workers` processes and recorded in a manifest with a fingerprint of their inputs, so that an interrupted run resumes where it stopped and only volumes whose annotations, metadata, extracted features or code changed are redone. If an EFCache is given, volumes are read through it.'''
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    manifest_path = os.path.join(folder, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+
+    tasks = []
+    for row in md.to_dict('records'):
+        subset_annotated_df = annotated_df.loc[annotated_df.original_volumes == row['date']]
+        input_fingerprint = combine_fingerprints(frame_fingerprint(subset_annotated_df), json.dumps(row, sort_keys=True, default=str), folder, store_path)
+        ef_fingerprint = get_ef_fingerprint(row['htid'], ef_cache)
+        # Stop on an offline miss before any work is submitted, rather than from inside the pool
+        if (ef_cache is not None) and ef_cache.offline and (ef_fingerprint is None):
+            raise EFCacheMiss(f"{row['htid']} is not in the cache at {ef_cache.cache_dir}")
+        if is_volume_done(manifest.get(row['htid']), volume_fingerprint(input_fingerprint, ef_fingerprint)):
+            continue
+        tasks.append((row['htid'], row, subset_annotated_df, folder, store_path, ef_cache, input_fingerprint))
+
+    records = []
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_volume, *task) for task in tasks]
+            recorded = set()
+            try:
+                for future in as_completed(futures):
+                    record = future.result()
+                    recorded.add(future)
+                    record_volume(manifest_path, record, records)
+            except BaseException:
+                # Cancel the volumes that have not started and keep the ones that finished, so a rerun does not redo them
+                executor.shutdown(wait=True, cancel_futures=True)
+                for future in futures:
+                    if (future not in recorded) and future.done() and (not future.cancelled()) and (future.exception() is None):
+                        record_volume(manifest_path, future.result(), records)
+                raise
+    else:
+        for task in tasks:
+            record_volume(manifest_path, process_volume(*task), records)
+    return records
 
 def add_volumes_dates(title, file_name, magazine_title, date_vols):
     output_file = file_name.split('.csv')[0] + '_grouped.csv'
@@ -144,51 +272,56 @@ def add_volumes_dates(title, file_name, magazine_title, date_vols):
     
 #     final_df.to_csv(title + '_grouped.csv')
 
-def process_metadatas():
-    '''This function is used to process the metadata files (i.e. the htids) and combine them with the annotated files. It reads in the metadata files and then calls the read_ids function.'''
-    # Get all directories of hathi_ef_datasets
-    dir_list = [subdir for subdir, _, _ in os.walk('../ht_ef_datasets/')]
-    annotated_mapping_df = pd.read_csv('annotation_metadata_mapping.csv')
-    dfs = []
-    
-    for subdir, _, files in os.walk('../metadatas'):
-        get_files = IncrementalBar('processing metadata', max=len(files))
-        for f in files:
-            get_files.next()
-            if '.csv' in f:
-                # Get relevant annotation file
-                annotation_row = annotated_mapping_df.loc[annotated_mapping_df['metadata_file'] == subdir + '/' + f].copy()
-                # Start creating file name and joining directories for files
-                file_name = f.split('.')[0]
-                filenames = file_name.split('_')
-                filenames = [ fi for fi in filenames if fi.isdigit() == False]
-
-                filenames = '_'.join(filenames)
-                # print(filenames)
-                md = pd.read_csv(subdir+ '/'+f, encoding = "utf-8")
-                annotated_df = pd.read_csv(annotation_row.annotation_file.values[0])
-                final_dir = ''
-                for dir_name in dir_list:
-                    dirnames = dir_name.split('/')[-1].split('_')
-                    dirnames = [ di.lower() for di in dirnames if di.isdigit() == False]
-                    dirnames = '_'.join(dirnames)
-                    dirnames = dirnames.split('_hathitrust')[0]
-                    fuzziness =fuzz.ratio(filenames, dirnames)
-                    if fuzziness > 70:
-                        final_dir = dir_name
-                        df = pd.DataFrame([{'local_dir': dir_name.split('/')[-1], 'file_name': filenames, 'fuzzy_ratio': fuzziness, 'metadata_file': subdir+ '/'+f, 'final_dir': final_dir}])
-                        dfs.append(df)
-                annotated_df.Dates = annotated_df.Dates.str.replace('Decmeber', 'December')
-                annotated_df.Dates = annotated_df.Dates.str.replace('Summer', 'July')
-                annotated_df = clean_annotated_df(annotated_df)
-                read_ids(md, final_dir, annotated_df)
-            get_files.finish()
-    dfs = pd.concat(dfs)
-    final_df = pd.merge(annotated_mapping_df, dfs, on='metadata_file')
-    final_df.to_csv('directory_annotation_metadata_mapping.csv', index=False)
+def process_metadatas(workers=1, store_path=None, ef_cache=None):
+    '''This function is used to process the metadata files (i.e. the htids) and combine them with the annotated files. Each metadata file is resolved to its directory of ../ht_ef_datasets through the saved directory mapping, then the read_ids function is called with `workers` processes, writing csvs or into the Parquet store at `store_path` and reading volumes through `ef_cache` if given.'''
+    with stage('resolve_directories') as event:
+        mapping = get_directory_mapping()
+        event['rows'] = len(mapping)
+
+    for row in mapping.to_dict('records'):
+        metadata_file = row['metadata_file']
+        if pd.isna(row['annotation_file']):
+            print(f'No annotation file for {metadata_file}, skipping')
+            continue
+        md = pd.read_csv(metadata_file, encoding = "utf-8")
+        annotated_df = pd.read_csv(row['annotation_file'])
+        annotated_df.Dates = annotated_df.Dates.str.replace('Decmeber', 'December')
+        annotated_df.Dates = annotated_df.Dates.str.replace('Summer', 'July')
+        with stage('clean_annotations', metadata_file=metadata_file) as event:
+            annotated_df = clean_annotated_df(annotated_df)
+            event['rows'] = len(annotated_df)
+        with stage('metadata_file', metadata_file=metadata_file) as event:
+            records = read_ids(md, row['final_dir'], annotated_df, workers=workers, store_path=store_path, ef_cache=ef_cache)
+            event['rows'] = sum(record['rows'] for record in records)
 
 
 if __name__ ==  "__main__" :
-    process_metadatas()
+    parser = argparse.ArgumentParser(description='Extract and annotate HathiTrust volumes')
+    parser.add_argument('--workers', type=int, default=1, help='number of volumes to process in parallel')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], default='csv', help='write one csv per volume or a partitioned Parquet store')
+    parser.add_argument('--store-path', default='../ht_ef_parquet', help='location of the Parquet store')
+    parser.add_argument('--cache-dir', default=None, help='read volumes through a local Extracted Features cache')
+    parser.add_argument('--cache-size-gb', type=float, default=None, help='maximum size of the Extracted Features cache')
+    parser.add_argument('--offline', action='store_true', help='only read volumes from the cache and stop on a miss')
+    parser.add_argument('--log-file', default=None, help='write one JSON line per volume and stage to this file instead of stderr')
+    parser.add_argument('--report', default='pipeline_report.json', help='write a per-stage summary report to this file')
+    parser.add_argument('--profile-htid', default=None, help='run this volume under cProfile')
+    parser.add_argument('--profile-dir', default='profiles', help='where to write the profile of --profile-htid')
+    args = parser.parse_args()
+    configure_logging(args.log_file)
+    if args.profile_htid is not None:
+        enable_profiling(args.profile_htid, args.profile_dir)
+    store_path = args.store_path if args.output_format == 'parquet' else None
+    ef_cache = None
+    if args.cache_dir is not None:
+        max_bytes = int(args.cache_size_gb * 1024 ** 3) if args.cache_size_gb is not None else None
+        ef_cache = EFCache(args.cache_dir, max_bytes=max_bytes, offline=args.offline)
+    elif args.offline:
+        parser.error('--offline requires --cache-dir')
+    try:
+        process_metadatas(workers=args.workers, store_path=store_path, ef_cache=ef_cache)
+    finally:
+        instrumentation.write_report(args.report)
+        print(instrumentation.summary().to_string(index=False))
 
     
\ No newline at end of file
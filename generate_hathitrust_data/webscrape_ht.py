@@ -1,25 +1,66 @@
 from bs4 import BeautifulSoup
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 import os
 import shutil
-from progress.bar import IncrementalBar
+import argparse
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from compute_magazines.instrumentation import instrumentation, stage, configure_logging
 
-def get_hathi_links(url, output_path, annotated_df):
+CATALOG_URL = 'https://catalog.hathitrust.org/Record/{record_id}'
+
+def get_session(workers=8, retries=5, backoff_factor=0.5):
+    '''Create a session that keeps a pool of connections open for the workers and retries failed requests with exponential backoff.'''
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def fetch_record(session, record_id, cache_dir, base_url=CATALOG_URL):
+    '''Get the html of a Hathi Trust record page, reading it from the on-disk cache if it has been fetched before.'''
+    cache_path = os.path.join(cache_dir, f'{record_id}.html')
+    if os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            return f.read()
+    with stage('fetch', record_id) as event:
+        result = session.get(base_url.format(record_id=record_id), timeout=60)
+        result.raise_for_status()
+        partial_path = cache_path + '.partial'
+        with open(partial_path, 'wb') as f:
+            f.write(result.content)
+        os.replace(partial_path, cache_path)
+        event['bytes_written'] = len(result.content)
+    return result.content
+
+def fetch_records(record_ids, cache_dir, workers=8, base_url=CATALOG_URL):
+    """Fetch record pages concurrently with at most `workers` requests in flight and return them by record id"""
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    record_ids = list(dict.fromkeys(record_ids))
+    with get_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        pages = executor.map(lambda record_id: fetch_record(session, record_id, cache_dir, base_url), record_ids)
+        return dict(zip(record_ids, pages))
+
+def get_hathi_links(ht_page, annotated_df):
     '''This function scrapes volume links from a Hathi Trust record page.'''
-    result = requests.get(url)
-    ht_page = result.content
     soup = BeautifulSoup(ht_page, 'html.parser')
-    
-    write_dataframe(soup, output_path, annotated_df)
-   
 
-def write_dataframe(soup, output_path, annotated_df):
-    """This function writes a dataframe containing the correct hathitrust id and link, along with listed volumes to a csv file. We check for what volumes we want to keep using the original annotated dataset file"""
+    return get_volume_rows(soup, annotated_df)
+
+
+def get_volume_rows(soup, annotated_df):
+    """This function gets the correct hathitrust id and link, along with listed volumes for each volume on the record page. We check for what volumes we want to keep using the original annotated dataset file"""
     links = soup.find_all('tr')
-    
+
     vols = annotated_df.original_volumes.unique().tolist()
     vols = [vol for vol in vols if str(vol) != 'nan']
+    rows = []
     for l in links:
         if any( vol in l.get_text() for vol in vols):
             date = l.find(attrs={"class":"IndItem"})
@@ -29,44 +70,70 @@ def write_dataframe(soup, output_path, annotated_df):
             new_df['link'] = link
             new_df['date'] = date.text
             new_df['htid']= htid
-        
-            dl = pd.DataFrame([new_df])
-            if os.path.exists(output_path):
-                dl.to_csv(output_path, mode='a', header=False, index=False)
-            else:
-                dl.to_csv(output_path, header=True, index=False)
+            rows.append(new_df)
+    return rows
 
-def get_catalog_records():
-    """This function takes an annotation spreadsheet and scrapes the relevant Hathi Trust catalog page and returns a dataframe containing the Hathi Trust id and link"""
+def write_dataframe(rows, output_path):
+    """This function writes all the volume rows for a metadata file to a csv file in one go"""
+    dl = pd.DataFrame(rows, columns=['link', 'date', 'htid'])
+    if os.path.exists(output_path):
+        dl.to_csv(output_path, mode='a', header=False, index=False)
+    else:
+        dl.to_csv(output_path, header=True, index=False)
+
+def get_record_ids(annotation_df):
+    """Get the Hathi Trust record ids listed in the notes of an annotation spreadsheet"""
+    record_ids = []
+    records = annotation_df[annotation_df.notes.str.lower().str.contains('record')].notes.tolist()
+    for record in records:
+        [record_ids.append(chunk) for chunk in record.split(' ') if chunk.isdigit()]
+    return record_ids
+
+def get_catalog_records(workers=8, cache_dir='../catalog_cache', base_url=CATALOG_URL):
+    """This function takes an annotation spreadsheet and scrapes the relevant Hathi Trust catalog page and returns a dataframe containing the Hathi Trust id and link. Record pages are fetched concurrently and cached in cache_dir, so reruns do not hit the network."""
     output_file = 'annotation_metadata_mapping.csv'
     if os.path.exists(output_file):
         os.remove(output_file)
     if os.path.exists('../metadatas'):
         shutil.rmtree('../metadatas')
-    os.makedirs('../metadatas') 
+    os.makedirs('../metadatas')
+    annotations = []
     for subdir, dirs, files in os.walk('../annotated_datasets'):
-        get_files = IncrementalBar('getting metadata links', max=len(files))
         for f in files:
-            get_files.next()
-            record_ids = []
             if (f.endswith('.csv')) and ('freedomways' not in f):
                 annotation_df = pd.read_csv(subdir+ '/'+f, encoding = "utf-8")
                 annotation_df.columns = ['_'.join(x.lower().split(' ')) for x in annotation_df.columns]
                 annotation_df.notes.fillna('', inplace=True)
-                records = annotation_df[annotation_df.notes.str.lower().str.contains('record')].notes.tolist()
-                for record in records:
-                    [record_ids.append(chunk) for chunk in record.split(' ') if chunk.isdigit()]
-                for record_id in record_ids:
-                    combined_ids = '_'.join(record_ids)
-                    output_path = '../metadatas' + '/' + f.split('_annotated')[0] + f'_{combined_ids}.csv'
-                    url = f'https://catalog.hathitrust.org/Record/{record_id}'
-                    get_hathi_links(url, output_path, annotation_df)
-                    df = pd.DataFrame([{'annotation_file': subdir+ '/'+f, 'metadata_file': output_path, 'magazine_name': f.split('_annotated')[0]}])
-                    if os.path.exists(output_file):
-                        df.to_csv(output_file, mode='a', header=False, index=False)
-                    else:
-                        df.to_csv(output_file, header=True, index=False)
-        get_files.finish()
-if __name__ ==  "__main__" :
-    get_catalog_records()
+                annotations.append((subdir, f, annotation_df, get_record_ids(annotation_df)))
 
+    pages = fetch_records([record_id for _, _, _, record_ids in annotations for record_id in record_ids], cache_dir, workers, base_url)
+
+    mapping_rows = []
+    for subdir, f, annotation_df, record_ids in annotations:
+        if len(record_ids) == 0:
+            continue
+        combined_ids = '_'.join(record_ids)
+        output_path = '../metadatas' + '/' + f.split('_annotated')[0] + f'_{combined_ids}.csv'
+        rows = []
+        with stage('parse', combined_ids, annotation_file=f) as event:
+            for record_id in record_ids:
+                rows.extend(get_hathi_links(pages[record_id], annotation_df))
+                mapping_rows.append({'annotation_file': subdir+ '/'+f, 'metadata_file': output_path, 'magazine_name': f.split('_annotated')[0]})
+            event['rows'] = len(rows)
+        if len(rows) > 0:
+            with stage('write', combined_ids, annotation_file=f) as event:
+                write_dataframe(rows, output_path)
+                event['rows'] = len(rows)
+                event['bytes_written'] = os.path.getsize(output_path)
+    pd.DataFrame(mapping_rows, columns=['annotation_file', 'metadata_file', 'magazine_name']).to_csv(output_file, header=True, index=False)
+
+if __name__ ==  "__main__" :
+    parser = argparse.ArgumentParser(description='Scrape Hathi Trust catalog records for the annotated magazines')
+    parser.add_argument('--workers', type=int, default=8, help='number of concurrent requests')
+    parser.add_argument('--cache-dir', default='../catalog_cache', help='directory for cached record pages')
+    parser.add_argument('--base-url', default=CATALOG_URL, help='record url template, e.g. a local test server')
+    parser.add_argument('--log-file', default=None, help='write one JSON line per request and stage to this file instead of stderr')
+    args = parser.parse_args()
+    configure_logging(args.log_file)
+    get_catalog_records(workers=args.workers, cache_dir=args.cache_dir, base_url=args.base_url)
+    print(instrumentation.summary().to_string(index=False))
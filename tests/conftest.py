@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The packages are run as scripts from their own directories, so put the repository root on the path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
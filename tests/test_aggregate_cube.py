@@ -0,0 +1,19 @@
+import pandas as pd
+from compute_magazines.aggregate_cube import build_cube
+from compute_magazines.calculate_coverage import overall_frequency_data
+
+def test_cube_and_dataframe_give_the_same_overall_frequency(tmp_path):
+    uncombined_df_path = str(tmp_path / 'combined.csv')
+    pd.DataFrame({
+        'cleaned_magazine_title': ['arab_observer'] * 4 + ['afro_asian_bulletin'] * 2,
+        'datetime': ['1965-06-07'] * 3 + ['1965-06-14'] + ['1967-06-01'] * 2,
+        'htid': 'mdp.001', 'sequence': [1, 1, 2, 1, 1, 1], 'type_of_page': ['cover_page', None, None, None, None, None],
+        'token': ['third', 'world', 'world', 'world', 'imperialism', 'asia'], 'count': [1, 2, 3, 1, 2, 1],
+    }).to_csv(uncombined_df_path, index=False)
+    cube = build_cube(uncombined_df_path, chunksize=2)
+    df = pd.read_csv(uncombined_df_path).rename(columns={'cleaned_magazine_title': 'magazine_title', 'count': 'original_counts'})
+    df['datetime'] = pd.to_datetime(df.datetime)
+    from_cube = overall_frequency_data(cube=cube)
+    from_df = overall_frequency_data(df)
+    pd.testing.assert_frame_equal(from_cube[['datetime', 'magazine_title', 'size', 'original_counts']], from_df[['datetime', 'magazine_title', 'size', 'original_counts']], check_dtype=False)
+    assert from_cube['size'].tolist() == [3, 1, 2]
@@ -0,0 +1,34 @@
+import pandas as pd
+import dask.dataframe as dd
+import pytest
+from compute_magazines.calculate_coverage import compare_pub_counts
+
+GROUP_COLUMNS = ['magazine_title', 'datetime']
+VARIANTS = {'imperialism': ['imperialism', 'imperialisms', 'imperialsm', 'imperial ism'], 'colonial': ['colonial', 'colonia']}
+
+def pages():
+    return pd.DataFrame({
+        'magazine_title': ['arab_observer', 'arab_observer', 'afro_asian_bulletin'],
+        'datetime': pd.to_datetime(['1965-06-07', '1965-06-07', '1967-06-01']),
+        'page_number': [1, 2, 1],
+        'original_counts': [3, 4, 5],
+        'token': ['the imperialisms colonial', 'imperialism and imperial ism colonia', 'imperialsm imperialism'],
+    })
+
+def term_counts(df, terms, variants=None):
+    counts = compare_pub_counts(df, GROUP_COLUMNS, 'original_counts', 'token', terms, variants=variants)
+    return counts.set_index(['term', 'magazine_title']).term_counts.to_dict()
+
+@pytest.mark.parametrize('to_frame', [lambda df: df, lambda df: dd.from_pandas(df, npartitions=2)])
+def test_overlapping_variants_are_counted_once(to_frame):
+    counts = term_counts(to_frame(pages()), ['imperialism', 'colonial'], VARIANTS)
+    assert counts[('imperialism', 'arab_observer')] == 3
+    assert counts[('imperialism', 'afro_asian_bulletin')] == 2
+    assert counts[('colonial', 'arab_observer')] == 2
+
+@pytest.mark.parametrize('to_frame', [lambda df: df, lambda df: dd.from_pandas(df, npartitions=2)])
+def test_terms_without_variants_count_literal_occurrences(to_frame):
+    counts = term_counts(to_frame(pages()), ['imperialism', 'colonia'])
+    assert counts[('imperialism', 'arab_observer')] == 2
+    assert counts[('imperialism', 'afro_asian_bulletin')] == 1
+    assert counts[('colonia', 'arab_observer')] == 2
@@ -0,0 +1,17 @@
+import os
+import pandas as pd
+from compute_magazines.dask_coverage import read_corpus
+
+def write_volume(path, **columns):
+    os.makedirs(os.path.dirname(path))
+    pd.DataFrame(dict({'htid': 'mdp.001', 'sequence': [1, 2], 'token': ['arab', 'world'], 'count': [1, 2]}, **columns)).to_csv(path, index=False)
+
+def test_read_corpus_aligns_volumes_with_different_annotations(tmp_path):
+    write_volume(str(tmp_path / 'Arab_Observer_HathiTrust' / 'v1.csv'), notes=['', ''])
+    write_volume(str(tmp_path / 'Afro_Asian_Bulletin_HathiTrust' / 'v1.csv'), htid='mdp.002', notes=['1-2', 'Not actually a cover'], volumes=['v. 1', 'v. 1'])
+    df = read_corpus(str(tmp_path / '*' / '*.csv')).compute().sort_values(by=['htid', 'sequence']).reset_index(drop=True)
+    assert df.columns.tolist() == ['htid', 'sequence', 'token', 'count', 'notes', 'volumes']
+    assert df.notes.fillna('').tolist() == ['', '', '1-2', 'Not actually a cover']
+    assert df.volumes.isna().tolist() == [True, True, False, False]
+    assert df['count'].sum() == 6
+    assert read_corpus(str(tmp_path / '*' / '*.csv'), columns=['htid', 'volumes']).compute().columns.tolist() == ['htid', 'volumes']
@@ -0,0 +1,29 @@
+import os
+import pandas as pd
+from compute_magazines.directory_resolver import get_directory_mapping
+
+def test_directory_mapping_has_one_row_per_metadata_file(tmp_path):
+    metadata_directory = tmp_path / 'metadatas'
+    ef_directory = tmp_path / 'ht_ef_datasets'
+    os.makedirs(metadata_directory)
+    os.makedirs(ef_directory / 'Arab_Observer_HathiTrust')
+    os.makedirs(ef_directory / 'Afro_Asian_Bulletins_HathiTrust')
+    metadata_files = [str(metadata_directory / name) for name in ['arab_observer_000679918_006064523.csv', 'afro_asian_bulletin_000500.csv', 'tricontinental_000700.csv']]
+    for metadata_file in metadata_files:
+        pd.DataFrame({'link': [], 'date': [], 'htid': []}).to_csv(metadata_file, index=False)
+    annotation_mapping_path = str(tmp_path / 'annotation_metadata_mapping.csv')
+    pd.DataFrame({
+        'annotation_file': ['arab_observer_annotated.csv', 'arab_observer_annotated.csv', 'afro_asian_bulletin_annotated.csv'],
+        'metadata_file': [metadata_files[0], metadata_files[0], metadata_files[1]],
+        'magazine_name': ['arab_observer', 'arab_observer', 'afro_asian_bulletin'],
+    }).to_csv(annotation_mapping_path, index=False)
+
+    mapping = get_directory_mapping(str(tmp_path / 'mapping.csv'), str(metadata_directory), str(ef_directory), annotation_mapping_path)
+    assert sorted(mapping.metadata_file) == sorted(metadata_files)
+    final_dirs = dict(zip(mapping.metadata_file, mapping.final_dir))
+    assert os.path.basename(final_dirs[metadata_files[0]]) == 'Arab_Observer_HathiTrust'
+    assert os.path.basename(final_dirs[metadata_files[1]]) == 'Afro_Asian_Bulletins_HathiTrust'
+    assert os.path.basename(final_dirs[metadata_files[2]]) == 'tricontinental_HathiTrust'
+    assert mapping.set_index('metadata_file').annotation_file.isna().to_dict() == {metadata_files[0]: False, metadata_files[1]: False, metadata_files[2]: True}
+    # The saved mapping is reused as it is
+    assert get_directory_mapping(str(tmp_path / 'mapping.csv'), str(metadata_directory), str(ef_directory), annotation_mapping_path).equals(pd.read_csv(tmp_path / 'mapping.csv'))
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import pandas as pd
+import pytest
+import generate_hathitrust_data.ef_cache as ef_cache
+from generate_hathitrust_data.ef_cache import EFCache, EFCacheMiss, prefetch
+from compute_magazines.instrumentation import instrumentation
+
+def volume_tokens(token):
+    return pd.DataFrame({'page': [1, 2], 'section': 'body', 'lowercase': [token, 'world'], 'pos': 'NN', 'count': 1})
+
+@pytest.fixture
+def connections(monkeypatch):
+    '''Track every connection the cache opens'''
+    opened = []
+    class TrackedConnection(sqlite3.Connection):
+        closed = False
+        def close(self):
+            self.closed = True
+            super().close()
+    sqlite_connect = sqlite3.connect
+    def connect(*args, **kwargs):
+        opened.append(sqlite_connect(*args, factory=TrackedConnection, **kwargs))
+        return opened[-1]
+    monkeypatch.setattr(ef_cache.sqlite3, 'connect', connect)
+    return opened
+
+def test_cache_closes_its_connections(tmp_path, connections):
+    cache = EFCache(str(tmp_path), max_bytes=1, offline=True)
+    cache.put('mdp.001', 'Arab Observer', volume_tokens('arab'))
+    assert 'mdp.001' not in cache
+    with pytest.raises(EFCacheMiss):
+        cache.get('mdp.001')
+    assert len(connections) > 0
+    assert all(connection.closed for connection in connections)
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EFCache(str(tmp_path), offline=True)
+    cache.put('mdp.001', 'Arab Observer', volume_tokens('arab'))
+    cache.put('mdp.002', 'Arab Observer', volume_tokens('africa'))
+    cache.get('mdp.001')
+    with cache.connect() as connection:
+        size = connection.execute('SELECT size FROM volumes WHERE htid = ?', ('mdp.001',)).fetchone()[0]
+    cache.max_bytes = size
+    cache.evict()
+    assert ('mdp.001' in cache) and ('mdp.002' not in cache)
+    title, volume_df = cache.get('mdp.001')
+    assert (title == 'Arab Observer') and (volume_df.lowercase.tolist() == ['arab', 'world'])
+
+def test_cache_counts_shared_objects_once(tmp_path):
+    cache = EFCache(str(tmp_path), offline=True)
+    cache.put('mdp.001', 'Arab Observer', volume_tokens('arab'))
+    cache.put('mdp.002', 'Arab Observer', volume_tokens('arab'))
+    with cache.connect() as connection:
+        size = connection.execute('SELECT size FROM volumes WHERE htid = ?', ('mdp.001',)).fetchone()[0]
+    cache.max_bytes = size
+    cache.evict()
+    assert ('mdp.001' in cache) and ('mdp.002' in cache)
+
+def test_cache_reads_objects_without_holding_the_index_lock(tmp_path, monkeypatch):
+    cache = EFCache(str(tmp_path), offline=True)
+    cache.put('mdp.001', 'Arab Observer', volume_tokens('arab'))
+    read_parquet = pd.read_parquet
+    def read_while_writing(path):
+        # Another worker storing a volume while this one decodes its object
+        connection = sqlite3.connect(os.path.join(str(tmp_path), 'index.sqlite'), timeout=0)
+        with connection:
+            connection.execute('UPDATE volumes SET last_access = 0')
+        connection.close()
+        return read_parquet(path)
+    monkeypatch.setattr(ef_cache.pd, 'read_parquet', read_while_writing)
+    assert cache.get('mdp.001')[1].lowercase.tolist() == ['arab', 'world']
+
+def test_prefetch_records_a_fetch_event_per_volume(tmp_path):
+    cache = EFCache(str(tmp_path / 'cache'), offline=True)
+    cache.put('mdp.001', 'Arab Observer', volume_tokens('arab'))
+    metadata_file = str(tmp_path / 'arab_observer_000679918.csv')
+    pd.DataFrame({'link': '', 'date': 'v. 1', 'htid': ['mdp.001']}).to_csv(metadata_file, index=False)
+    prefetch(metadata_file, cache)
+    events = [event for event in instrumentation.events if event.get('source') == 'prefetch']
+    assert [(event['stage'], event['htid'], event['cached']) for event in events][-1] == ('fetch', 'mdp.001', True)
@@ -0,0 +1,11 @@
+from compute_magazines.fuzzy_terms import get_fuzzy_index, expand_terms
+
+def test_fuzzy_index_is_rebuilt_when_the_vocabulary_changes(tmp_path):
+    index_path = str(tmp_path / 'fuzzy')
+    assert list(get_fuzzy_index(index_path, ['imperialism', 'imperialsm']).vocabulary) == ['imperialism', 'imperialsm']
+    assert list(get_fuzzy_index(index_path, ['imperialism', 'imperialisms']).vocabulary) == ['imperialism', 'imperialisms']
+    assert list(get_fuzzy_index(index_path).vocabulary) == ['imperialism', 'imperialisms']
+
+def test_expand_terms_finds_ocr_variants_and_splits(tmp_path):
+    index = get_fuzzy_index(str(tmp_path / 'fuzzy'), ['imperialism', 'imperialsm', 'imperial', 'ism', 'world', 'word'])
+    assert expand_terms(index, ['imperialism', 'world']) == {'imperialism': ['imperialism', 'imperialsm', 'imperial ism'], 'world': ['world', 'word']}
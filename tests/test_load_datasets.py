@@ -0,0 +1,53 @@
+import os
+import pandas as pd
+from compute_magazines.document_store import ISSUE_COLUMNS
+from compute_magazines.fingerprints import fingerprint_path
+from compute_magazines.load_datasets import get_combined_issues, get_full_combined_dataset
+
+def combined_rows():
+    rows = pd.DataFrame({'sequence': [1, 1, 2], 'token': ['arab', 'world', 'africa'], 'pos': 'NN', 'count': [2, 1, 1], 'section': 'body'})
+    for column in ISSUE_COLUMNS:
+        if column not in rows.columns:
+            rows[column] = 'x'
+    rows['volume_number'] = 1
+    return rows
+
+def test_get_combined_issues_is_saved_and_reused(tmp_path):
+    uncombined_df_path = str(tmp_path / 'combined.csv')
+    output_path = str(tmp_path / 'issues.csv')
+    combined_rows().to_csv(uncombined_df_path, index=False)
+    issue_df = get_combined_issues(output_path, uncombined_df_path)
+    assert issue_df.token.tolist() == ['arab world', 'africa']
+    assert os.path.exists(output_path) and os.path.exists(fingerprint_path(output_path))
+
+    # The saved output is reused until the combined dataset changes
+    pd.DataFrame({'token': ['saved']}).to_csv(output_path, index=False)
+    assert get_combined_issues(output_path, uncombined_df_path).token.tolist() == ['saved']
+
+    combined_rows().assign(token=['arab', 'world', 'asia']).to_csv(uncombined_df_path, index=False)
+    os.utime(uncombined_df_path, ns=(1, 1))
+    assert get_combined_issues(output_path, uncombined_df_path).token.tolist() == ['arab world', 'asia']
+
+def write_volumes(output_directory):
+    os.makedirs(os.path.join(output_directory, 'Arab_Observer_HathiTrust'))
+    os.makedirs(os.path.join(output_directory, 'Afro_Asian_Bulletin_HathiTrust'))
+    pd.DataFrame({'magazine_title': 'arab_observer', 'title': 'arab_observer_v1', 'htid': 'mdp.001', 'link': 'https://hdl.handle.net/mdp.001', 'original_volumes': 'v. 1', 'volumes': 'v. 1',
+        'start_issue': ['1965-06-07', '1965-06-07', '1965-06-14'], 'page_number': [327, 328, 329], 'sequence': [327, 328, 329], 'type_of_page': 'content', 'notes': '',
+        'token': ['arab', 'world', 'nan'], 'pos': 'NN', 'count': [2, 1, 1], 'section': 'body'}).to_csv(os.path.join(output_directory, 'Arab_Observer_HathiTrust', 'Arab_Observer_v1.csv'), index=False)
+    pd.DataFrame({'magazine_title': 'afro_asian_bulletin', 'title': 'afro_asian_bulletin_v1', 'htid': 'mdp.002', 'link': 'https://hdl.handle.net/mdp.002', 'original_volumes': 'v. 1',
+        'start_issue': ['1967-06-01', '1967-06-01', None], 'page_number': [1, 2, 3], 'sequence': [1, 2, 3], 'type_of_page': 'content', 'notes': '', 'issue_number': [4.0, 4.0, None],
+        'token': ['africa', 'asia', 'unity'], 'pos': 'NN', 'count': [1, 3, 1], 'section': 'body'}).to_csv(os.path.join(output_directory, 'Afro_Asian_Bulletin_HathiTrust', 'Afro_Asian_Bulletin_v1.csv'), index=False)
+
+def comparable(df):
+    """Compare values, not dtypes: the streaming build reads back categoricals and downcast numbers"""
+    df = df.astype(object).where(df.notna(), None)
+    return df.sort_values(by=['htid', 'sequence', 'token']).reset_index(drop=True)
+
+def test_streaming_combined_dataset_matches_regular_build(tmp_path):
+    output_directory = str(tmp_path / 'volumes')
+    write_volumes(output_directory)
+    regular = get_full_combined_dataset(str(tmp_path / 'regular.csv'), output_directory)
+    streamed = get_full_combined_dataset(str(tmp_path / 'streamed.csv'), output_directory, streaming=True, chunksize=2)
+    assert streamed.columns.tolist() == regular.columns.tolist()
+    pd.testing.assert_frame_equal(comparable(streamed), comparable(regular), check_dtype=False)
+    assert regular.loc[regular.sequence == 328, 'type_of_page'].tolist() == ['cover_page']
@@ -0,0 +1,39 @@
+import pandas as pd
+from compute_magazines.page_numbers import infer_page_numbers
+
+def volume_tokens():
+    '''Four unnumbered front matter pages, pages numbered 1 to 10, two unnumbered plates that still take numbers 11 and 12, pages 13 to 16, then a new issue restarting at 1'''
+    printed = {sequence: sequence - 4 for sequence in range(5, 15)}
+    printed.update({sequence: sequence - 4 for sequence in range(17, 21)})
+    printed.update({sequence: sequence - 20 for sequence in range(21, 31)})
+    rows = [('mdp.001', sequence, 'arab') for sequence in range(1, 31)]
+    rows += [('mdp.001', sequence, str(number)) for sequence, number in printed.items()]
+    # Noise: a year, and a number in the text of a page
+    rows += [('mdp.001', 2, '1965'), ('mdp.001', 8, '3')]
+    rows += [('mdp.002', sequence, 'world') for sequence in range(1, 4)]
+    return pd.DataFrame(rows, columns=['htid', 'sequence', 'token'])
+
+def page_numbers(workers=1):
+    page_number_df = infer_page_numbers(volume_tokens(), workers=workers)
+    return page_number_df.set_index(['htid', 'sequence'])
+
+def test_front_matter_has_no_page_number():
+    pages = page_numbers().loc['mdp.001']
+    assert pages.inferred_page_number.loc[1:4].isna().all()
+    assert not pages.observed.loc[1:4].any()
+
+def test_numbered_pages_and_gaps():
+    pages = page_numbers().loc['mdp.001']
+    assert pages.inferred_page_number.loc[5:20].tolist() == list(range(1, 17))
+    assert pages.observed.loc[5:14].all()
+    assert not pages.observed.loc[15:16].any()
+
+def test_numbering_restart():
+    pages = page_numbers().loc['mdp.001']
+    assert pages.inferred_page_number.loc[21:30].tolist() == list(range(1, 11))
+    assert (pages.implied_zero.loc[21:30] == 20).all()
+
+def test_volumes_without_numbers_and_workers():
+    pages = page_numbers(workers=2)
+    assert pages.loc['mdp.002'].inferred_page_number.isna().all()
+    pd.testing.assert_frame_equal(pages, page_numbers())
@@ -0,0 +1,47 @@
+import os
+import pandas as pd
+import pytest
+from generate_hathitrust_data.ef_cache import EFCache, EFCacheMiss
+from generate_hathitrust_data.get_annotate_ht_volumes import read_ids, load_manifest, MANIFEST_FILE
+
+HTIDS = ['mdp.001', 'mdp.002', 'mdp.003']
+
+def volume_tokens(pages=3):
+    return pd.DataFrame({'page': [page for page in range(1, pages + 1) for _ in range(2)], 'section': 'body', 'lowercase': ['arab', 'world'] * pages, 'pos': 'NN', 'count': 1})
+
+def make_inputs(tmp_path, htids=HTIDS, cached=HTIDS):
+    cache = EFCache(str(tmp_path / 'cache'), offline=True)
+    for htid in cached:
+        cache.put(htid, 'Arab Observer.', volume_tokens())
+    md = pd.DataFrame({'htid': htids, 'date': [f'Volume {i}' for i in range(len(htids))], 'link': 'https://hdl.handle.net/'})
+    annotated_df = pd.DataFrame({'original_volumes': md.date, 'page_number': 1, 'type_of_page': 'cover_page', 'notes': ''})
+    return md, annotated_df, cache
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_read_ids_writes_manifest_and_resumes(tmp_path, workers):
+    md, annotated_df, cache = make_inputs(tmp_path)
+    folder = str(tmp_path / 'volumes')
+    records = read_ids(md, folder, annotated_df, workers=workers, ef_cache=cache)
+    assert sorted(record['htid'] for record in records) == HTIDS
+    assert all(record['status'] == 'done' for record in records)
+    manifest = load_manifest(os.path.join(folder, MANIFEST_FILE))
+    assert sorted(manifest) == HTIDS
+    assert all(os.path.exists(record['file_name']) for record in manifest.values())
+    # Nothing changed, so a second run has nothing to do
+    assert read_ids(md, folder, annotated_df, workers=workers, ef_cache=cache) == []
+
+def test_read_ids_redoes_changed_and_deleted_volumes(tmp_path):
+    md, annotated_df, cache = make_inputs(tmp_path)
+    folder = str(tmp_path / 'volumes')
+    records = read_ids(md, folder, annotated_df, ef_cache=cache)
+    os.remove([record['file_name'] for record in records if record['htid'] == 'mdp.001'][0])
+    annotated_df.loc[annotated_df.original_volumes == 'Volume 2', 'notes'] = 'changed'
+    assert sorted(record['htid'] for record in read_ids(md, folder, annotated_df, ef_cache=cache)) == ['mdp.001', 'mdp.003']
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_read_ids_stops_on_offline_miss_before_any_work(tmp_path, workers):
+    md, annotated_df, cache = make_inputs(tmp_path, cached=['mdp.001', 'mdp.003'])
+    folder = str(tmp_path / 'volumes')
+    with pytest.raises(EFCacheMiss):
+        read_ids(md, folder, annotated_df, workers=workers, ef_cache=cache)
+    assert load_manifest(os.path.join(folder, MANIFEST_FILE)) == {}
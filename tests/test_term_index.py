@@ -0,0 +1,13 @@
+import pandas as pd
+from compute_magazines.term_index import get_term_index
+
+def pages(tokens):
+    return pd.DataFrame({'cleaned_magazine_title': 'arab_observer', 'datetime': '1965-06-07', 'htid': 'mdp.001', 'sequence': range(1, len(tokens) + 1), 'token': tokens, 'count': 1})
+
+def test_term_index_is_rebuilt_when_its_input_changes(tmp_path):
+    index_path = str(tmp_path / 'index')
+    assert get_term_index(index_path, pages(['arab', 'world'])).vocabulary == ['arab', 'world']
+    assert get_term_index(index_path, pages(['arab', 'world'])).vocabulary == ['arab', 'world']
+    assert get_term_index(index_path, pages(['africa', 'asia'])).vocabulary == ['africa', 'asia']
+    assert get_term_index(index_path, pages(['africa', 'asia']), max_ngram=2, text_column='token').vocabulary == ['africa', 'asia']
+    assert get_term_index(index_path).vocabulary == ['africa', 'asia']
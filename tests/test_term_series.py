@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+from compute_magazines.document_store import ISSUE_COLUMNS, build_document_store
+from compute_magazines.term_series import TermSeries
+from compute_magazines.calculate_coverage import compare_pub_counts, create_line_graph_term_frequencies, create_regression_graph_term_frequencies
+
+def series():
+    df = pd.DataFrame({
+        'cleaned_magazine_title': ['arab_observer'] * 4 + ['afro_asian_bulletin'] * 2,
+        'datetime': ['1965-06-07'] * 3 + ['1965-06-14'] + ['1967-06-01'] * 2,
+        'sequence': [1, 1, 2, 1, 1, 1],
+        'token': ['third', 'world', 'world', 'world', 'imperialism', 'imperialsm'],
+        'count': [1, 2, 3, 1, 2, 1],
+    })
+    for column in ISSUE_COLUMNS:
+        if column not in df.columns:
+            df[column] = 'x'
+    return TermSeries(build_document_store(df))
+
+def test_term_matrix_counts_a_batch_of_terms_per_issue():
+    matrix = series().term_matrix(['world', 'imperialism', 'missing'])
+    assert matrix.index.names == ['magazine_title', 'datetime']
+    assert matrix['world'].tolist() == [0, 5, 1]
+    assert matrix['imperialism'].tolist() == [2, 0, 0]
+    assert matrix['missing'].sum() == 0
+    normalized = series().term_matrix(['world'], normalize=True)
+    assert normalized['world'].tolist() == [0, 5 / 6, 1]
+
+def test_term_counts_feed_the_charts():
+    term_counts = series().term_counts(['world', 'imperialism'], variants={'imperialism': ['imperialism', 'imperialsm', 'imperial ism']})
+    world = term_counts[(term_counts.term == 'world') & (term_counts.magazine_title == 'arab_observer')].iloc[0]
+    assert (world.term_counts, world.original_counts, world.page_counts, world.page_number) == (5, 6, 6, [1, 2])
+    imperialism = term_counts[term_counts.term == 'imperialism'].set_index('magazine_title')
+    assert imperialism.term_counts['afro_asian_bulletin'] == 3
+    create_line_graph_term_frequencies(term_counts, value_column='term_frequency').to_dict()
+    create_regression_graph_term_frequencies(term_counts).to_dict()
+
+def test_compare_pub_counts_reads_a_term_series():
+    term_counts = compare_pub_counts(None, ['magazine_title', 'datetime'], 'original_counts', None, ['world'], series=series())
+    assert term_counts.columns.tolist() == ['magazine_title', 'datetime', 'original_counts', 'term_counts', 'page_number', 'page_counts', 'term']
+
+def test_multi_word_terms_are_rejected():
+    with pytest.raises(ValueError):
+        series().term_matrix(['third world'])
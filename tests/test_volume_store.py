@@ -0,0 +1,32 @@
+import pandas as pd
+from compute_magazines.volume_store import write_volume, read_volumes
+
+def volume(htid, **columns):
+    df = pd.DataFrame({'magazine_title': 'arab_observer', 'htid': htid, 'sequence': [1, 2], 'token': ['arab', 'world'], 'count': [1, 2]})
+    for column, values in columns.items():
+        df[column] = values
+    return df
+
+def test_read_volumes_keeps_columns_of_later_volumes(tmp_path):
+    write_volume(volume('mdp.001'), str(tmp_path))
+    write_volume(volume('mdp.002', volumes=['v. 1', 'v. 1'], annotator=['zoe', 'zoe']), str(tmp_path))
+    df = read_volumes(str(tmp_path)).sort_values(by=['htid', 'sequence']).reset_index(drop=True)
+    assert {'volumes', 'annotator'} <= set(df.columns)
+    assert df.volumes.isna().tolist() == [True, True, False, False]
+    assert df.annotator.tolist()[2:] == ['zoe', 'zoe']
+
+def test_read_volumes_unifies_column_types(tmp_path):
+    write_volume(volume('mdp.001', number=[1, 2], notes=[3, 4]), str(tmp_path))
+    write_volume(volume('mdp.002', number=[1.5, None], notes=['1-2', '']), str(tmp_path))
+    df = read_volumes(str(tmp_path)).sort_values(by=['htid', 'sequence']).reset_index(drop=True)
+    assert df.number.tolist()[:3] == [1.0, 2.0, 1.5]
+    assert df.notes.tolist() == ['3', '4', '1-2', '']
+
+def test_read_volumes_only_opens_the_selected_partitions(tmp_path):
+    write_volume(volume('mdp.001', volumes=['v. 1', 'v. 1']), str(tmp_path))
+    other_file = write_volume(volume('mdp.002').assign(magazine_title='afro_asian_bulletin'), str(tmp_path))
+    with open(other_file, 'wb') as f:
+        f.write(b'not a parquet file')
+    df = read_volumes(str(tmp_path), magazines=['arab_observer'])
+    assert df.htid.unique().tolist() == ['mdp.001']
+    assert df.volumes.tolist() == ['v. 1', 'v. 1']
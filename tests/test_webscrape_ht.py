@@ -0,0 +1,73 @@
+import os
+import threading
+from collections import Counter
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+import pytest
+from generate_hathitrust_data.webscrape_ht import fetch_records, get_catalog_records
+
+RECORD_PAGE = '''<html><body><table>
+<tr><td class="IndItem">{volume} 1965</td><td><a class="rights-Array searchonly" href="https://hdl.handle.net/2027/mdp.{record_id}">Limited</a></td></tr>
+<tr><td class="IndItem">v. 99 1999</td><td><a class="rights-Array searchonly" href="https://hdl.handle.net/2027/mdp.other">Limited</a></td></tr>
+</table></body></html>'''
+
+class CatalogHandler(BaseHTTPRequestHandler):
+    '''Serves a record page for /Record/<id>, failing the first request for ids starting with "503"'''
+
+    def do_GET(self):
+        record_id = self.path.split('/')[-1]
+        self.server.hits[record_id] += 1
+        if record_id.startswith('503') and (self.server.hits[record_id] == 1):
+            self.send_response(503)
+            self.end_headers()
+            return
+        content = RECORD_PAGE.format(volume=self.server.volumes.get(record_id, 'v. 1'), record_id=record_id).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def catalog_server():
+    server = HTTPServer(('127.0.0.1', 0), CatalogHandler)
+    server.hits = Counter()
+    server.volumes = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f'http://127.0.0.1:{server.server_port}/Record/{{record_id}}'
+    server.shutdown()
+    server.server_close()
+
+def test_fetch_records_retries_failed_requests(tmp_path, catalog_server):
+    server, base_url = catalog_server
+    pages = fetch_records(['503001', '100'], str(tmp_path), workers=2, base_url=base_url)
+    assert b'mdp.503001' in pages['503001']
+    assert server.hits['503001'] == 2
+    assert server.hits['100'] == 1
+
+def test_fetch_records_reads_cached_pages(tmp_path, catalog_server):
+    server, base_url = catalog_server
+    record_ids = [str(record_id) for record_id in range(100, 120)]
+    first = fetch_records(record_ids + record_ids[:5], str(tmp_path), workers=4, base_url=base_url)
+    assert all(server.hits[record_id] == 1 for record_id in record_ids)
+    second = fetch_records(record_ids, str(tmp_path), workers=4, base_url=base_url)
+    assert first == second
+    assert sum(server.hits.values()) == len(record_ids)
+    assert not any(f.endswith('.partial') for f in os.listdir(tmp_path))
+
+def test_get_catalog_records_writes_each_metadata_file_once(tmp_path, catalog_server, monkeypatch):
+    server, base_url = catalog_server
+    server.volumes = {'101': 'v. 1', '102': 'v. 2'}
+    os.makedirs(tmp_path / 'annotated_datasets')
+    os.makedirs(tmp_path / 'scripts')
+    pd.DataFrame({'Notes': ['Record 101 102', ''], 'Original Volumes': ['v. 1', 'v. 2']}).to_csv(tmp_path / 'annotated_datasets' / 'arab_observer_annotated.csv', index=False)
+    monkeypatch.chdir(tmp_path / 'scripts')
+    get_catalog_records(workers=2, cache_dir=str(tmp_path / 'cache'), base_url=base_url)
+    md = pd.read_csv(tmp_path / 'metadatas' / 'arab_observer_101_102.csv')
+    assert md.htid.tolist() == ['mdp.101', 'mdp.102']
+    assert md.columns.tolist() == ['link', 'date', 'htid']
+    mapping = pd.read_csv(tmp_path / 'scripts' / 'annotation_metadata_mapping.csv')
+    assert set(mapping.metadata_file) == {'../metadatas/arab_observer_101_102.csv'}